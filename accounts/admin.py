@@ -1,7 +1,11 @@
 from django import forms
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
 from django.contrib.auth.models import Group
 from django.contrib.auth.forms import ReadOnlyPasswordHashField
+from django.core.exceptions import ValidationError
+from accounts import permission_cache, shards
+from starter.routers import read_from_replica
 from .models import User, Role
 
 
@@ -17,10 +21,40 @@ class UserChangeForm(forms.ModelForm):
         fields = ('email', 'role', 'is_active', 'is_verified', 'is_superuser')
 
 
+class ShardFilter(admin.SimpleListFilter):
+    """
+    With sharding on, the changelist lists one shard at a time, the first
+    unless another is picked. It pages with OFFSET and counts, which cannot
+    span shards, so there is no "All" choice.
+    """
+    title = 'shard'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in shards.aliases()]
+
+    def shard(self):
+        return self.value() or shards.aliases()[0]
+
+    def choices(self, changelist):
+        for lookup, title in self.lookup_choices:
+            yield {
+                'selected': self.shard() == lookup,
+                'query_string': changelist.get_query_string({self.parameter_name: lookup}),
+                'display': title,
+            }
+
+    def queryset(self, request, queryset):
+        if self.shard() not in shards.aliases():
+            raise IncorrectLookupParameters(f'Unknown shard {self.shard()}')
+
+        return queryset.using(self.shard())
+
+
 class UserAdmin(admin.ModelAdmin):
     form = UserChangeForm
 
-    list_display = ('email', 'role', 'is_verified')
+    list_display = ('email', 'role_name', 'is_verified')
     list_filter = ('role',)
     fieldsets = (
         (None, {'fields': ('email', 'is_active', 'is_verified', 'is_superuser',)}),
@@ -38,6 +72,43 @@ class UserAdmin(admin.ModelAdmin):
     ordering = ('email',)
     filter_horizontal = ()
 
+    def role_name(self, obj):
+        # From the in-process Role table rather than a query per row.
+        return permission_cache.get_role(obj.role_id)
+
+    role_name.short_description = 'role'
+    role_name.admin_order_field = 'role__name'
+
+    @property
+    def show_full_result_count(self):
+        # The unfiltered count would be the default database's alone.
+        return not shards.enabled()
+
+    def get_list_filter(self, request):
+        if shards.enabled():
+            return self.list_filter + (ShardFilter,)
+
+        return self.list_filter
+
+    def get_object(self, request, object_id, from_field=None):
+        if not shards.enabled() or from_field is not None:
+            return super().get_object(request, object_id, from_field)
+
+        try:
+            return shards.get(self.get_queryset(request), pk=object_id)
+        except (self.model.DoesNotExist, ValidationError, ValueError):
+            return None
+
+    def changelist_view(self, request, extra_context=None):
+        # The changelist is a TemplateResponse; render it here so its queries
+        # run while replica reads are still allowed.
+        with read_from_replica():
+            response = super().changelist_view(request, extra_context)
+            if hasattr(response, 'render'):
+                response.render()
+
+        return response
+
 
 class RoleAdmin(admin.ModelAdmin):
     pass
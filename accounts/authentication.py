@@ -0,0 +1,213 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+
+import redis
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.translation import ugettext as _
+from rest_framework import exceptions
+from rest_framework_jwt.authentication import JSONWebTokenAuthentication, jwt_get_username_from_payload
+from rest_framework_jwt.utils import jwt_payload_handler as default_jwt_payload_handler
+
+from accounts import permission_cache, shards
+from accounts.cache import LRUCache, get_redis
+from accounts.models import User
+
+logger = logging.getLogger(__name__)
+
+CACHED_FIELDS = ('id', 'email', 'is_active', 'is_verified', 'is_staff', 'is_superuser', 'role_id')
+PASSWORD_MARKER_CLAIM = 'pwd'
+INVALIDATION_CHANNEL = 'accounts:auth:invalidate'
+
+local_cache = LRUCache(settings.AUTH_CACHE_LOCAL_SIZE, settings.AUTH_CACHE_LOCAL_TTL)
+
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+
+def password_marker(password_hash):
+    """Short digest of the stored hash; changes whenever the password does."""
+    return hashlib.sha256(password_hash.encode()).hexdigest()[:16]
+
+
+def jwt_payload_handler(user):
+    """
+    Default django-rest-framework-jwt payload plus the password marker, so
+    tokens issued before a password change stop authenticating.
+    """
+    payload = default_jwt_payload_handler(user)
+    payload[PASSWORD_MARKER_CLAIM] = password_marker(user.password)
+
+    return payload
+
+
+def _email_key(email):
+    return f'accounts:auth:email:{email}'
+
+
+def _id_key(user_id):
+    return f'accounts:auth:id:{user_id}'
+
+
+def auth_state(user):
+    state = {name: getattr(user, name) for name in CACHED_FIELDS}
+    state['id'] = str(user.id)
+    state['role_id'] = str(user.role_id) if user.role_id else None
+    state['password_marker'] = password_marker(user.password)
+    # The shard the row lives on, so saves through the cached user go back there.
+    state['db'] = user._state.db if user._state.db in shards.aliases() else DEFAULT_DB_ALIAS
+
+    return state
+
+
+def user_from_state(state):
+    """
+    Build a User holding only the cached columns. Every other field is
+    deferred, so it loads on first access and save() only writes what we hold.
+    The role comes from the in-process Role table.
+    """
+    values = dict(state,
+                  id=uuid.UUID(state['id']),
+                  role_id=uuid.UUID(state['role_id']) if state['role_id'] else None)
+    field_names = [f.attname for f in User._meta.concrete_fields if f.attname in values]
+
+    user = User.from_db(state.get('db', DEFAULT_DB_ALIAS), field_names, [values[name] for name in field_names])
+
+    role = permission_cache.get_role(user.role_id)
+    if role is not None:
+        User._meta.get_field('role').set_cached_value(user, role)
+
+    return user
+
+
+def get_auth_state(email):
+    """
+    Resolve the auth-relevant fields for ``email`` from the in-process LRU,
+    then Redis, then the database. Returns None for unknown users.
+    """
+    key = _email_key(email)
+
+    state = local_cache.get(key)
+    if state is not None:
+        return state
+
+    _ensure_listener()
+
+    try:
+        raw = get_redis().get(key)
+    except redis.RedisError:
+        logger.warning('Auth cache read failed for %s', email, exc_info=True)
+        raw = None
+
+    if raw is not None:
+        state = json.loads(raw)
+    else:
+        try:
+            user = User.objects.get_by_natural_key(email)
+        except User.DoesNotExist:
+            return None
+
+        state = auth_state(user)
+
+        try:
+            get_redis().pipeline() \
+                .set(key, json.dumps(state), ex=settings.AUTH_CACHE_REDIS_TTL) \
+                .set(_id_key(state['id']), email, ex=settings.AUTH_CACHE_REDIS_TTL) \
+                .execute()
+        except redis.RedisError:
+            logger.warning('Auth cache write failed for %s', email, exc_info=True)
+
+    local_cache.set(key, state)
+
+    return state
+
+
+def invalidate(user_id, email=None):
+    """
+    Drop cached auth state for a user everywhere: this process, Redis, and
+    every other process through the invalidation channel. The email the entry
+    was cached under is looked up by id as well, so email changes and callers
+    that only know the id are covered.
+    """
+    emails = {email} if email else set()
+
+    try:
+        client = get_redis()
+        previous = client.get(_id_key(user_id))
+        if previous is not None:
+            emails.add(previous.decode())
+
+        pipe = client.pipeline()
+        pipe.delete(_id_key(user_id), *[_email_key(e) for e in emails])
+        for e in emails:
+            pipe.publish(INVALIDATION_CHANNEL, e)
+        pipe.execute()
+    except redis.RedisError:
+        logger.warning('Auth cache invalidation failed for %s', user_id, exc_info=True)
+
+    for e in emails:
+        local_cache.delete(_email_key(e))
+
+
+def _on_invalidation(message):
+    local_cache.delete(_email_key(message['data'].decode()))
+
+
+def _ensure_listener():
+    """
+    Subscribe this process to the invalidation channel. Tracked per pid so
+    each forked gunicorn worker starts its own listener thread.
+    """
+    global _listener_pid
+
+    if _listener_pid == os.getpid():
+        return
+
+    with _listener_lock:
+        if _listener_pid == os.getpid():
+            return
+
+        try:
+            pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{INVALIDATION_CHANNEL: _on_invalidation})
+            pubsub.run_in_thread(sleep_time=1, daemon=True)
+        except redis.RedisError:
+            logger.warning('Auth cache listener failed to start', exc_info=True)
+            return
+
+        _listener_pid = os.getpid()
+
+
+class CachedJSONWebTokenAuthentication(JSONWebTokenAuthentication):
+    """
+    JSONWebTokenAuthentication that resolves the user from the auth cache, so
+    a warm authenticated request makes no database queries.
+    """
+
+    def authenticate_credentials(self, payload):
+        username = jwt_get_username_from_payload(payload)
+
+        if not username:
+            msg = _('Invalid payload.')
+            raise exceptions.AuthenticationFailed(msg)
+
+        state = get_auth_state(username)
+
+        if state is None:
+            msg = _('Invalid signature.')
+            raise exceptions.AuthenticationFailed(msg)
+
+        if not state['is_active']:
+            msg = _('User account is disabled.')
+            raise exceptions.AuthenticationFailed(msg)
+
+        marker = payload.get(PASSWORD_MARKER_CLAIM)
+        if marker is not None and marker != state['password_marker']:
+            msg = _('Password has changed.')
+            raise exceptions.AuthenticationFailed(msg)
+
+        return user_from_state(state)
@@ -0,0 +1,68 @@
+"""
+Multi-get of users by id and/or email, see UserViewSet.batch.
+
+Inputs are de-duplicated and looked up a chunk at a time, one
+``WHERE ... IN (...)`` query per chunk (per shard in parallel when sharding
+is on). Rows come back as values_list() tuples and are rendered by
+UserRowSerializer, the same fast path as the list endpoint.
+"""
+import uuid
+
+from django.conf import settings
+
+from accounts import shards
+from accounts.models import User
+from accounts.serializers import UserRowSerializer
+
+
+def _fetch(lookup, values, columns):
+    chunk_size = settings.USER_BATCH_CHUNK_SIZE
+    rows = []
+
+    for start in range(0, len(values), chunk_size):
+        chunk = values[start:start + chunk_size]
+        found = shards.fan_out(lambda alias: list(User.objects.using(alias)
+                                                  .filter(**{f'{lookup}__in': chunk})
+                                                  .values_list(*columns, named=True)))
+        rows.extend(row for matches in found.values() for row in matches)
+
+    return rows
+
+
+def get_users(ids=(), emails=(), fields=None):
+    """
+    Return {'ids': {id: user or None}, 'emails': {email: user or None},
+    'missing': {'ids': [...], 'emails': [...]}}, keyed by the values as given.
+    """
+    serializer = UserRowSerializer(fields=fields)
+    # id and email are always read, to key the results, whatever ``fields`` asks for.
+    columns = list(dict.fromkeys(UserRowSerializer.columns(fields) + ['id', 'email']))
+
+    ids = list(dict.fromkeys(ids))
+    emails = list(dict.fromkeys(emails))
+
+    parsed = {}
+    for value in ids:
+        try:
+            parsed[value] = uuid.UUID(str(value))
+        except ValueError:
+            parsed[value] = None
+
+    by_id = {row.id: row for row in _fetch('id', list({pk for pk in parsed.values() if pk is not None}), columns)}
+    # Matched on lower(email), like every other email lookup, so case variants find the user.
+    by_email = {row.email.lower(): row
+                for row in _fetch('email__lower', list({email.lower() for email in emails}), columns)}
+
+    def represent(row):
+        return serializer.to_representation(row) if row is not None else None
+
+    results = {
+        'ids': {value: represent(by_id.get(parsed[value])) for value in ids},
+        'emails': {value: represent(by_email.get(value.lower())) for value in emails},
+    }
+    results['missing'] = {
+        'ids': [value for value in ids if results['ids'][value] is None],
+        'emails': [value for value in emails if results['emails'][value] is None],
+    }
+
+    return results
@@ -0,0 +1,46 @@
+"""
+Helpers shared by the ``bench_*`` management commands.
+"""
+import statistics
+import time
+
+from django.contrib.auth.hashers import make_password
+
+from accounts.models import User
+
+BENCH_EMAIL_DOMAIN = 'bench.example.com'
+
+
+def seed_users(count, batch_size=5000):
+    """Insert ``count`` throwaway users, all sharing one pre-computed hash."""
+    password = make_password('benchmark')
+    start = User.objects.filter(email__endswith='@' + BENCH_EMAIL_DOMAIN).count()
+
+    for offset in range(start, start + count, batch_size):
+        stop = min(offset + batch_size, start + count)
+        User.objects.bulk_create(
+            [User(email=f'user-{i}@{BENCH_EMAIL_DOMAIN}', password=password) for i in range(offset, stop)]
+        )
+
+    return start + count
+
+
+def purge_users():
+    return User.objects.filter(email__endswith='@' + BENCH_EMAIL_DOMAIN).delete()[0]
+
+
+def percentile(timings, fraction):
+    """The value ``fraction`` of the way through sorted ``timings``."""
+    return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+
+def measure(fn, repeat=20):
+    """Run ``fn`` ``repeat`` times and return the median and p99 in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+
+    timings.sort()
+    return statistics.median(timings), percentile(timings, 0.99)
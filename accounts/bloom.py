@@ -0,0 +1,244 @@
+"""
+Bloom filter of registered emails, so lookups of unknown addresses on the
+unauthenticated flows (registration, password reset requests, verification
+resends) are answered without a database query.
+
+The filter is a Redis bitmap sized from EMAIL_BLOOM_CAPACITY and
+EMAIL_BLOOM_ERROR_RATE; its key carries the size, so processes never disagree
+about the layout. Each process keeps a copy. A hit in the copy means "maybe
+registered" and goes on to the database. A miss is confirmed against Redis,
+which has every email added since the copy was taken, and only then does "not
+registered" skip the database; a miss Redis contradicts is set in the copy.
+The copy is downloaded again only after a rebuild, which bumps the version
+held in the ready marker, checked every EMAIL_BLOOM_LOCAL_TTL seconds. Until
+the rebuild_email_bloom command has built the filter, or whenever Redis
+fails, every email counts as maybe registered.
+
+Emails are added on user save and by the bulk paths. Bits are never cleared,
+so deleted users only cost false positives until the next rebuild. Run a
+rebuild after changing the size settings and after a Redis outage, as adds
+made while Redis was down are lost.
+"""
+import hashlib
+import logging
+import math
+import threading
+import time
+
+import redis
+from django.conf import settings
+
+from accounts import metrics
+from accounts.cache import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Seconds a rebuild may go without a sign of life before adds stop being recorded for it.
+REBUILD_TIMEOUT = 600
+
+# KEYS are the filter, the rebuild marker and the positions set during a
+# rebuild; ARGV the bit positions to set.
+ADD = """
+local rebuilding = redis.call('EXISTS', KEYS[2]) == 1
+
+for _, position in ipairs(ARGV) do
+    redis.call('SETBIT', KEYS[1], position, 1)
+    if rebuilding then
+        redis.call('SADD', KEYS[3], position)
+    end
+end
+
+return 0
+"""
+
+# KEYS are the rebuilt filter, the filter, the rebuild marker, the positions
+# set during the rebuild and the ready marker, which holds the filter's version.
+FINISH = """
+for _, position in ipairs(redis.call('SMEMBERS', KEYS[4])) do
+    redis.call('SETBIT', KEYS[1], position, 1)
+end
+
+redis.call('RENAME', KEYS[1], KEYS[2])
+redis.call('DEL', KEYS[3], KEYS[4])
+
+return redis.call('INCR', KEYS[5])
+"""
+
+_mirror = None
+_mirror_lock = threading.Lock()
+_scripts = None
+
+
+def size(capacity=None, error_rate=None):
+    """Return the optimal (bits, hashes) for ``capacity`` emails at ``error_rate``."""
+    capacity = capacity or settings.EMAIL_BLOOM_CAPACITY
+    error_rate = error_rate or settings.EMAIL_BLOOM_ERROR_RATE
+
+    bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+
+    return bits, max(1, round(bits / capacity * math.log(2)))
+
+
+def false_positive_rate(count, bits, hashes):
+    """Expected false positive rate of a filter holding ``count`` emails."""
+    return (1 - math.exp(-hashes * count / bits)) ** hashes
+
+
+def _key():
+    bits, hashes = size()
+
+    return f'accounts:emails:bloom:{bits}:{hashes}'
+
+
+def positions(email, bits, hashes):
+    # Two halves of one digest, combined as in Kirsch & Mitzenmacher.
+    digest = hashlib.blake2b((email or '').strip().lower().encode(), digest_size=16).digest()
+    first, second = int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big') | 1
+
+    return [(first + i * second) % bits for i in range(hashes)]
+
+
+def _test(data, found):
+    # Redis numbers bits from the most significant bit of the first byte.
+    return all(position >> 3 < len(data) and data[position >> 3] & (0x80 >> (position & 7))
+               for position in found)
+
+
+def _set(data, found):
+    for position in found:
+        data[position >> 3] |= 0x80 >> (position & 7)
+
+
+def _get_mirror():
+    """The process's copy of the filter, or None if it has not been built."""
+    global _mirror
+
+    mirror = _mirror
+    if mirror is not None and mirror['checked'] >= time.monotonic() - settings.EMAIL_BLOOM_LOCAL_TTL:
+        return mirror if mirror['data'] is not None else None
+
+    # One thread checks for a new version while the others carry on with the
+    # copy they have, or without one; the download happens outside any lock
+    # they wait on, and only when the version changed.
+    if not _mirror_lock.acquire(blocking=False):
+        return mirror if mirror is not None and mirror['data'] is not None else None
+
+    try:
+        key = _key()
+        client = get_redis()
+        version = client.get(f'{key}:ready')
+
+        if mirror is not None and version == mirror['version']:
+            mirror['checked'] = time.monotonic()
+        else:
+            data = None
+            if version is not None:
+                version, data = client.pipeline().get(f'{key}:ready').get(key).execute()
+
+            bits, _ = size()
+            mirror = _mirror = {
+                'version': version,
+                'data': bytearray((data or b'').ljust(-(-bits // 8), b'\0')) if version is not None else None,
+                'checked': time.monotonic(),
+            }
+    finally:
+        _mirror_lock.release()
+
+    return mirror if mirror['data'] is not None else None
+
+
+def might_exist(email):
+    """False only when no user is registered with ``email``."""
+    bits, hashes = size()
+    found = positions(email, bits, hashes)
+
+    try:
+        mirror = _get_mirror()
+        if mirror is None or _test(mirror['data'], found):
+            metrics.incr('email_bloom.maybe')
+            return True
+
+        key = _key()
+        pipe = get_redis().pipeline(transaction=False).exists(f'{key}:ready')
+        for position in found:
+            pipe.getbit(key, position)
+        ready, *present = pipe.execute()
+    except redis.RedisError:
+        logger.warning('Email filter check failed, falling back to the database', exc_info=True)
+        return True
+
+    if not ready or all(present):
+        if ready:
+            # Added by another process since the copy was taken.
+            _set(mirror['data'], found)
+        metrics.incr('email_bloom.maybe')
+        return True
+
+    metrics.incr('email_bloom.absent')
+    return False
+
+
+def _get_scripts():
+    global _scripts
+
+    if _scripts is None:
+        client = get_redis()
+        _scripts = client.register_script(ADD), client.register_script(FINISH)
+
+    return _scripts
+
+
+def add(*emails):
+    """Record ``emails`` as registered, in Redis and in this process's copy."""
+    bits, hashes = size()
+    key = _key()
+    found = []
+
+    try:
+        mirror = _get_mirror()
+
+        for email in emails:
+            found.extend(positions(email, bits, hashes))
+
+        if not found:
+            return
+
+        _get_scripts()[0](keys=[key, f'{key}:rebuilding', f'{key}:pending'], args=found)
+
+        if mirror is not None:
+            _set(mirror['data'], found)
+    except redis.RedisError:
+        logger.error('Could not add %d emails to the email filter, rebuild it once Redis is back',
+                     len(emails), exc_info=True)
+
+
+def rebuild(emails):
+    """
+    Replace the filter with one built from ``emails`` and return it as a
+    bytearray with the number of emails added.
+
+    ``emails`` must be read after this is called: emails added while the
+    rebuild runs are recorded on the side and merged into the new filter.
+    """
+    global _mirror
+
+    bits, hashes = size()
+    key = _key()
+    data = bytearray(-(-bits // 8))
+    count = 0
+
+    client = get_redis()
+    client.pipeline().delete(f'{key}:pending').set(f'{key}:rebuilding', 1, ex=REBUILD_TIMEOUT).execute()
+
+    for email in emails:
+        _set(data, positions(email, bits, hashes))
+        count += 1
+
+        if not count % 100000:
+            client.expire(f'{key}:rebuilding', REBUILD_TIMEOUT)
+
+    client.set(f'{key}:rebuild', bytes(data))
+    _get_scripts()[1](keys=[f'{key}:rebuild', key, f'{key}:rebuilding', f'{key}:pending', f'{key}:ready'])
+    _mirror = None
+
+    return data, count
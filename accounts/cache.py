@@ -0,0 +1,75 @@
+import collections
+import logging
+import threading
+import time
+
+import redis
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_redis = None
+_redis_lock = threading.Lock()
+
+
+def get_redis():
+    """
+    Shared client for the cache database on REDIS_HOST. The connection pool is
+    created lazily so forked workers never inherit a parent's sockets.
+    """
+    global _redis
+
+    if _redis is None:
+        with _redis_lock:
+            if _redis is None:
+                _redis = redis.StrictRedis.from_url(settings.REDIS_CACHE_URL,
+                                                    socket_timeout=settings.REDIS_CACHE_TIMEOUT,
+                                                    socket_connect_timeout=settings.REDIS_CACHE_TIMEOUT)
+
+    return _redis
+
+
+class LRUCache(object):
+    """
+    Small thread-safe in-process LRU whose entries also expire after ``ttl``
+    seconds, so a missed invalidation can only be stale for that long.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
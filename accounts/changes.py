@@ -0,0 +1,110 @@
+"""
+Incremental user changes feed, see UserViewSet.changes.
+
+Changed users come from accounts_user in (last_updated, id) order on
+accounts_user_updated_id_idx, deleted users from UserTombstone in
+(deleted_at, id) order. Both streams are merged on that key, and the key of
+the last item returned becomes the cursor for the next call. Rows changed in
+the last CHANGES_FEED_LAG_SECONDS are held back, so a transaction that
+commits late with an earlier timestamp is not skipped.
+"""
+import base64
+import datetime
+import json
+import uuid
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from accounts import shards
+from accounts.models import User, UserTombstone
+
+CHANGED = 'changed'
+DELETED = 'deleted'
+
+
+class CursorExpired(APIException):
+    status_code = status.HTTP_410_GONE
+    default_detail = _('Cursor is older than the tombstone retention window, resync from the start.')
+    default_code = 'cursor_expired'
+
+
+def encode_cursor(when, pk):
+    raw = json.dumps([when.isoformat(), str(pk)]).encode()
+
+    return base64.urlsafe_b64encode(raw).decode()
+
+
+def decode_cursor(value):
+    try:
+        when, pk = json.loads(base64.urlsafe_b64decode(value.encode()))
+        when, pk = parse_datetime(when), uuid.UUID(pk)
+    except (TypeError, ValueError):
+        raise ValidationError({'since': 'Invalid cursor.'})
+
+    if when is None:
+        raise ValidationError({'since': 'Invalid cursor.'})
+
+    return when, pk
+
+
+def _after(queryset, field, cursor):
+    if cursor is None:
+        return queryset
+
+    when, pk = cursor
+
+    # A range scan from the cursor's timestamp, skipping the rows at that exact
+    # timestamp the previous page already returned.
+    return queryset.filter(**{f'{field}__gte': when}).exclude(**{field: when, 'id__lte': pk})
+
+
+def read_changes(since=None, limit=None):
+    """
+    Return up to ``limit`` changes after the ``since`` cursor, oldest first,
+    with the cursor to resume from and whether more changes are waiting.
+    """
+    limit = limit or settings.CHANGES_FEED_PAGE_SIZE
+    cursor = decode_cursor(since) if since else None
+    now = timezone.now()
+    until = now - datetime.timedelta(seconds=settings.CHANGES_FEED_LAG_SECONDS)
+
+    if cursor is not None and cursor[0] < now - datetime.timedelta(days=settings.USER_TOMBSTONE_RETENTION_DAYS):
+        raise CursorExpired()
+
+    def page(alias):
+        users = _after(User.objects.using(alias), 'last_updated', cursor) \
+            .filter(last_updated__lt=until) \
+            .order_by('last_updated', 'id') \
+            .values('id', 'email', 'is_active', 'is_verified', 'last_updated')[:limit + 1]
+        tombstones = _after(UserTombstone.objects.using(alias), 'deleted_at', cursor) \
+            .filter(deleted_at__lt=until) \
+            .order_by('deleted_at', 'id') \
+            .values('id', 'deleted_at')[:limit + 1]
+
+        return [(row['last_updated'], row['id'], dict(row, type=CHANGED)) for row in users] + \
+               [(row['deleted_at'], row['id'], dict(row, type=DELETED)) for row in tombstones]
+
+    # Every stream is cut at limit + 1, so the first limit + 1 merged items are exact.
+    items = sorted((item for items in shards.fan_out(page).values() for item in items),
+                   key=lambda item: item[:2])
+
+    has_more = len(items) > limit
+    items = items[:limit]
+
+    if has_more:
+        since = encode_cursor(*items[-1][:2])
+    else:
+        # Everything before ``until`` has been seen, so resume from there. This
+        # keeps the cursor of an idle consumer inside the retention window.
+        since = encode_cursor(until, uuid.UUID(int=0))
+
+    return {
+        'results': [row for _, _, row in items],
+        'cursor': since,
+        'has_more': has_more,
+    }
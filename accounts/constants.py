@@ -1 +1,5 @@
 TOKEN_TYPES = (('VERIFY', 'VERIFY'), ('RESET', 'RESET'))
+
+# Outbound messages: the token each command issues and the email subject it is sent with
+MESSAGE_TOKEN_TYPES = {'verify': 'VERIFY', 'reset': 'RESET'}
+MESSAGE_SUBJECTS = {'verify': 'Confirm your email address', 'reset': 'Reset your password'}
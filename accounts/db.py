@@ -0,0 +1,73 @@
+"""
+Persistent connection housekeeping.
+
+With CONN_MAX_AGE set, connections outlive requests. Before a request reuses
+one that has sat idle longer than DB_HEALTH_CHECK_IDLE seconds we ping it and
+drop it if the server went away, so the request transparently reconnects
+instead of failing on a stale socket. Open connections per worker process are
+reported through accounts.metrics.
+"""
+import logging
+import threading
+import time
+import weakref
+
+from django.conf import settings
+from django.core.signals import request_finished, request_started
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from accounts import metrics
+
+logger = logging.getLogger(__name__)
+
+# Every connection wrapper this process has opened, across all request threads.
+_wrappers = weakref.WeakSet()
+_wrappers_lock = threading.Lock()
+
+
+def _open_connections():
+    with _wrappers_lock:
+        return sum(1 for conn in list(_wrappers) if conn.connection is not None)
+
+
+@receiver(request_started)
+def check_connections(**kwargs):
+    now = time.monotonic()
+
+    for conn in connections.all():
+        if conn.connection is None:
+            continue
+
+        released = getattr(conn, 'released_at', None)
+        if released is not None and now - released < settings.DB_HEALTH_CHECK_IDLE:
+            continue
+
+        if not conn.is_usable():
+            logger.info('Dropping stale %s database connection', conn.alias)
+            metrics.incr('db.connections_dropped')
+            conn.close()
+
+    metrics.gauge('db.open_connections', _open_connections())
+
+
+@receiver(request_finished)
+def release_connections(**kwargs):
+    now = time.monotonic()
+
+    for conn in connections.all():
+        if conn.connection is not None:
+            conn.released_at = now
+
+    metrics.gauge('db.open_connections', _open_connections())
+
+
+@receiver(connection_created)
+def count_connection(sender, connection, **kwargs):
+    connection.released_at = None
+
+    with _wrappers_lock:
+        _wrappers.add(connection)
+
+    metrics.incr('db.connections_opened')
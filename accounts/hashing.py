@@ -0,0 +1,182 @@
+"""
+Password hashing off the request thread.
+
+PBKDF2 is CPU bound for hundreds of milliseconds, so hashing runs on a
+pluggable executor (PASSWORD_HASHING_EXECUTOR). The process pool executor
+bounds queued + in-flight work and fails fast with a 503 and Retry-After once
+that bound is reached, instead of letting requests pile up behind it. Every
+password takes a slot; batches go through in rounds and wait for room rather
+than crowding out interactive requests.
+"""
+import contextlib
+import os
+import threading
+import time
+from concurrent import futures
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.utils.module_loading import import_string
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from accounts import metrics
+
+
+class HashingUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _('Too many password operations in progress, try again shortly.')
+    default_code = 'hashing_unavailable'
+
+    def __init__(self, wait, detail=None, code=None):
+        super().__init__(detail, code)
+        # DRF's exception handler turns `wait` into a Retry-After header.
+        self.wait = wait
+
+
+class InlineHashingExecutor(object):
+    """Hash on the calling thread. Useful for management commands and debugging."""
+
+    def run(self, fn, *args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            metrics.timing('hashing.latency', (time.perf_counter() - started) * 1000)
+
+    def map(self, fn, iterable):
+        return [self.run(fn, item) for item in iterable]
+
+
+class ProcessPoolHashingExecutor(object):
+    """
+    Process pool sized to the cores, with at most ``max_queue`` operations
+    queued or running at once per worker process. Operations that time out or
+    hit a crashed pool are answered with the same 503 as a full queue.
+    """
+
+    def __init__(self, workers=None, max_queue=None, timeout=None, retry_after=None):
+        self.workers = workers or settings.PASSWORD_HASHING_WORKERS
+        self.max_queue = settings.PASSWORD_HASHING_MAX_QUEUE if max_queue is None else max_queue
+        self.timeout = timeout or settings.PASSWORD_HASHING_TIMEOUT
+        self.retry_after = retry_after or settings.PASSWORD_HASHING_RETRY_AFTER
+
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._freed = threading.Condition(self._lock)
+        self._depth = 0
+
+    def _get_pool(self):
+        # A pool inherited through fork has no live workers, rebuild it per pid.
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+                self._pid = os.getpid()
+
+            return self._pool
+
+    def _track(self, delta):
+        with self._lock:
+            self._depth += delta
+            depth = self._depth
+            if delta < 0:
+                self._freed.notify_all()
+
+        metrics.gauge('hashing.queue_depth', depth)
+        return depth
+
+    @contextlib.contextmanager
+    def _admit(self, slots=1, wait=0):
+        """Hold ``slots`` queue slots, waiting up to ``wait`` seconds for them to free up."""
+        deadline = time.monotonic() + wait
+        with self._freed:
+            while self._depth + slots > self.max_queue:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    metrics.incr('hashing.rejected')
+                    raise HashingUnavailable(self.retry_after)
+                self._freed.wait(remaining)
+
+            self._depth += slots
+            depth = self._depth
+
+        metrics.gauge('hashing.queue_depth', depth)
+        started = time.perf_counter()
+        try:
+            yield self._get_pool()
+        except futures.TimeoutError:
+            metrics.incr('hashing.timed_out')
+            raise HashingUnavailable(self.retry_after)
+        except BrokenProcessPool:
+            with self._lock:
+                self._pool = None
+            metrics.incr('hashing.broken')
+            raise HashingUnavailable(self.retry_after)
+        finally:
+            self._track(-slots)
+            metrics.timing('hashing.latency', (time.perf_counter() - started) * 1000)
+
+    def run(self, fn, *args):
+        with self._admit() as pool:
+            return pool.submit(fn, *args).result(self.timeout)
+
+    def map(self, fn, iterable):
+        """
+        Fan ``fn`` out across the pool, one slot per item. Items go in rounds
+        of at most ``workers``, so a batch holds no more than a round's slots
+        and the rest of the queue stays open to run(). A round waits up to
+        ``timeout`` for its slots before the batch gives up.
+        """
+        items = list(iterable)
+        size = max(1, min(self.workers, self.max_queue))
+        results = []
+
+        for start in range(0, len(items), size):
+            batch = items[start:start + size]
+            with self._admit(len(batch), wait=self.timeout) as pool:
+                results.extend(pool.map(fn, batch, timeout=self.timeout))
+
+        return results
+
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+
+    if _executor is None:
+        _executor = import_string(settings.PASSWORD_HASHING_EXECUTOR)()
+
+    return _executor
+
+
+def make_password(password):
+    if password is None:
+        return hashers.make_password(None)
+
+    return get_executor().run(hashers.make_password, password)
+
+
+def check_password(password, encoded, setter=None):
+    """
+    Same contract as django.contrib.auth.hashers.check_password, with the
+    verification itself run on the executor and the upgrade done here.
+    """
+    if password is None or not hashers.is_password_usable(encoded):
+        return False
+
+    is_correct = get_executor().run(hashers.check_password, password, encoded)
+
+    if setter and is_correct:
+        preferred = hashers.get_hasher('default')
+        hasher = hashers.identify_hasher(encoded)
+
+        if hasher.algorithm != preferred.algorithm or preferred.must_update(encoded):
+            setter(password)
+
+    return is_correct
@@ -0,0 +1,275 @@
+"""
+Bulk user import for migrating whole user bases, see the import_users command.
+
+Records are read from JSON Lines or CSV and processed in chunks. Each record
+carries an ``email`` and either a plaintext ``password``, hashed in parallel
+on the hashing executor, or a ``password_hash`` already in Django's hasher
+format, stored as is. Records with neither get an unusable password.
+
+On Postgres each chunk is COPYed into a temporary staging table and merged
+into accounts_user with a single INSERT ... SELECT ... ON CONFLICT (email),
+so an existing email, or one repeated in the input in any case, costs nothing. Other
+backends fall back to bulk_create, which is enough for development but stamps
+date_joined with the time of the import.
+"""
+import csv
+import io
+import sys
+
+import orjson
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from accounts import authentication, bloom, hashing, permission_cache, shards
+from accounts.models import User
+
+FORMATS = ('csv', 'jsonl')
+SKIP = 'skip'
+UPDATE = 'update'
+ON_CONFLICT = (SKIP, UPDATE)
+
+STAGING_TABLE = 'accounts_user_import'
+COLUMNS = ('id', 'email', 'password', 'is_active', 'is_verified', 'date_joined')
+
+_TRUE = ('1', 't', 'true', 'y', 'yes')
+
+
+def read_records(path, input_format=None):
+    """Yield (line number, record dict) for each record of ``path``, '-' for stdin."""
+    if input_format is None:
+        input_format = 'csv' if path.endswith('.csv') else 'jsonl'
+
+    source = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+    try:
+        if input_format == 'csv':
+            # Line 1 is the header.
+            yield from enumerate(csv.DictReader(source), 2)
+            return
+
+        for number, line in enumerate(source, 1):
+            if not line.strip():
+                continue
+
+            try:
+                yield number, orjson.loads(line)
+            except orjson.JSONDecodeError:
+                yield number, None
+    finally:
+        if source is not sys.stdin:
+            source.close()
+
+
+def _flag(value, default):
+    if value is None or value == '':
+        return default
+
+    if isinstance(value, bool):
+        return value
+
+    return str(value).strip().lower() in _TRUE
+
+
+def _clean(record, now):
+    """Return (row values without the password, plaintext, encoded, errors) for one record."""
+    if not isinstance(record, dict):
+        return None, None, None, ['Expected an object with an email.']
+
+    errors = []
+    email = record.get('email') or ''
+    password = record.get('password') or None
+    encoded = record.get('password_hash') or None
+
+    if not isinstance(email, str):
+        errors.append('email must be a string.')
+        email = ''
+    else:
+        email = User.objects.normalize_email(email)
+        try:
+            validate_email(email)
+        except ValidationError as exc:
+            errors.extend(exc.messages)
+
+    for name, value in (('password', password), ('password_hash', encoded)):
+        if value is not None and not isinstance(value, str):
+            errors.append(f'{name} must be a string.')
+
+    if password is not None and encoded is not None:
+        errors.append('Give either password or password_hash, not both.')
+    elif isinstance(encoded, str):
+        try:
+            hashers.identify_hasher(encoded)
+        except ValueError:
+            errors.append('password_hash is not in a known hasher format.')
+
+    date_joined = record.get('date_joined') or None
+    if date_joined is not None:
+        date_joined = parse_datetime(date_joined) if isinstance(date_joined, str) else None
+        if date_joined is None:
+            errors.append('date_joined is not an ISO 8601 datetime.')
+        elif timezone.is_naive(date_joined):
+            date_joined = timezone.make_aware(date_joined, timezone.utc)
+
+    row = {
+        'id': shards.tag(User._meta.pk.get_default(), shards.bucket_for_email(email)),
+        'email': email,
+        'is_active': _flag(record.get('is_active'), True),
+        'is_verified': _flag(record.get('is_verified'), False),
+        'date_joined': date_joined or now,
+    }
+
+    return row, password, encoded, errors
+
+
+def _copy_merge(alias, rows, on_conflict):
+    """
+    COPY ``rows`` into the staging table and merge them, returning how many
+    were written and the (id, email) of the existing users that were updated.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # seq is the row's position in the input, rows being kept in input order.
+    for seq, row in enumerate(rows):
+        writer.writerow([row['id'], row['email'], row['password'], row['is_active'], row['is_verified'],
+                         row['date_joined'].isoformat(), seq])
+    buffer.seek(0)
+
+    if on_conflict == UPDATE:
+        conflict = ('DO UPDATE SET password = EXCLUDED.password, is_active = EXCLUDED.is_active, '
+                    'is_verified = EXCLUDED.is_verified, last_updated = EXCLUDED.last_updated')
+    else:
+        conflict = 'DO NOTHING'
+
+    columns = ', '.join(COLUMNS)
+    with transaction.atomic(using=alias), connections[alias].cursor() as cursor:
+        # The staging table lives as long as the session and is emptied by each commit.
+        cursor.execute(f'CREATE TEMPORARY TABLE IF NOT EXISTS {STAGING_TABLE} '
+                       f'(id uuid, email varchar(255), password varchar(128), is_active boolean, '
+                       f'is_verified boolean, date_joined timestamp with time zone, seq integer) '
+                       f'ON COMMIT DELETE ROWS')
+        cursor.copy_expert(f'COPY {STAGING_TABLE} ({columns}, seq) FROM STDIN WITH (FORMAT csv)', buffer)
+        # DISTINCT ON keeps the first of an email repeated within the chunk, which
+        # ON CONFLICT DO UPDATE would otherwise reject. The conflict target is
+        # accounts_user_email_lower_uniq, so case variants count as the same email.
+        cursor.execute(
+            f'INSERT INTO accounts_user ({columns}, is_staff, is_superuser, last_updated) '
+            f'SELECT DISTINCT ON (lower(email)) {columns}, false, false, now() FROM {STAGING_TABLE} '
+            f'ORDER BY lower(email), seq '
+            f'ON CONFLICT ((lower(email))) {conflict} '
+            # xmax is only set on the rows ON CONFLICT DO UPDATE rewrote.
+            f'RETURNING id, email, (xmax <> 0)'
+        )
+        written = cursor.fetchall()
+
+    return len(written), [(pk, email) for pk, email, updated in written if updated]
+
+
+def _fallback_merge(alias, rows, on_conflict):
+    emails = {row['email'].lower() for row in rows}
+    existing = {email.lower() for email in User.objects.using(alias).filter(email__lower__in=emails)
+                                                                    .values_list('email', flat=True)}
+    updated = []
+
+    if on_conflict == UPDATE:
+        for row in rows:
+            if row['email'].lower() in existing:
+                matches = User.objects.using(alias).filter(email__lower=row['email'].lower())
+                updated.extend(matches.values_list('id', 'email'))
+                matches.update(password=row['password'], is_active=row['is_active'],
+                               is_verified=row['is_verified'], last_updated=timezone.now())
+
+    users, seen = [], set(existing)
+    for row in rows:
+        if row['email'].lower() not in seen:
+            seen.add(row['email'].lower())
+            users.append(User(**row))
+
+    return len(updated) + len(User.objects.bulk_insert(users, settings.BULK_REGISTER_BATCH_SIZE, alias)), updated
+
+
+def _merge(alias, rows, on_conflict):
+    alias = alias or DEFAULT_DB_ALIAS
+    if connections[alias].vendor == 'postgresql':
+        return _copy_merge(alias, rows, on_conflict)
+
+    return _fallback_merge(alias, rows, on_conflict)
+
+
+def _import_chunk(chunk, stats, on_conflict, invalid):
+    now = timezone.now()
+    rows, plaintext = [], []
+
+    for number, record in chunk:
+        row, password, encoded, errors = _clean(record, now)
+        if errors:
+            stats['invalid'] += 1
+            if invalid is not None:
+                invalid(number, errors)
+            continue
+
+        row['password'] = encoded
+        rows.append(row)
+        plaintext.append(password)
+
+    # Plaintext passwords are hashed across the executor's worker processes in one batch.
+    pending = [index for index, password in enumerate(plaintext) if password is not None]
+    encoded = hashing.get_executor().map(hashers.make_password, [plaintext[index] for index in pending])
+    for index, password in zip(pending, encoded):
+        rows[index]['password'] = password
+
+    for row in rows:
+        if row['password'] is None:
+            row['password'] = hashers.make_password(None)
+
+    by_shard = {}
+    for row in rows:
+        by_shard.setdefault(shards.db_for_email(row['email']), []).append(row)
+
+    written, updated = 0, []
+    for alias, group in by_shard.items():
+        count, changed = _merge(alias, group, on_conflict)
+        written += count
+        updated.extend(changed)
+
+    # bulk_create, update() and COPY send no post_save, so the email filter and
+    # the caches of rewritten users are looked after here, once the chunk is committed.
+    bloom.add(*(row['email'] for row in rows))
+    for pk, email in updated:
+        authentication.invalidate(pk, email)
+        permission_cache.invalidate_user(pk)
+
+    stats['read'] += len(chunk)
+    stats['imported'] += written
+    stats['skipped'] += len(rows) - written
+
+
+def import_users(records, chunk_size=None, on_conflict=SKIP, progress=None, invalid=None):
+    """
+    Import (line number, record) pairs as yielded by read_records() and return
+    counts of rows read, imported, skipped as duplicates and invalid.
+
+    ``progress`` is called with the running counts after each chunk and
+    ``invalid`` with the line number and errors of each rejected record.
+    """
+    chunk_size = chunk_size or settings.IMPORT_CHUNK_SIZE
+    stats = {'read': 0, 'imported': 0, 'skipped': 0, 'invalid': 0}
+    chunk = []
+
+    for item in records:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            _import_chunk(chunk, stats, on_conflict, invalid)
+            chunk = []
+            if progress is not None:
+                progress(stats)
+
+    if chunk:
+        _import_chunk(chunk, stats, on_conflict, invalid)
+        if progress is not None:
+            progress(stats)
+
+    return stats
@@ -0,0 +1,210 @@
+"""
+Outbound email pipeline.
+
+``enqueue`` buffers rendered messages in a Redis list. ``drain`` moves them in
+batches of MAIL_BATCH_SIZE onto a processing list and sends each batch over
+one email backend connection that the worker process keeps open between
+batches. Messages that still fail after a reconnect are moved to a dead-letter
+list. A batch leaves the processing list only once it has been handled, so a
+worker that dies mid-batch loses nothing: the next drain sends what it left,
+at the cost of repeating any of it that had already gone out.
+
+Only one drainer runs at a time. It holds a lock for MAIL_DRAIN_LOCK_MS and
+extends it as it goes, so a long drain keeps it to the end, and stops if the
+lock was lost anyway.
+"""
+import json
+import logging
+import os
+import time
+import uuid
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+
+from accounts import metrics
+from accounts.cache import get_redis
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_KEY = 'accounts:mail:outbox'
+PROCESSING_KEY = 'accounts:mail:processing'
+DEAD_LETTER_KEY = 'accounts:mail:dead'
+DRAIN_LOCK_KEY = 'accounts:mail:drain-lock'
+
+_RELEASE_LOCK = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+_EXTEND_LOCK = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+class LockLost(Exception):
+    """The drain lock expired and may be held by another drainer."""
+
+
+_connection = None
+_connection_key = None
+
+
+def enqueue(*payloads):
+    """
+    Buffer messages, each a dict with ``to``, ``subject`` and ``body``, and
+    return the outbox length.
+    """
+    # Pushed on the left and moved from the right, so messages go out in order.
+    return get_redis().lpush(OUTBOX_KEY, *[json.dumps(payload) for payload in payloads])
+
+
+def _get_connection():
+    """Email backend connection reused by every batch this process sends."""
+    global _connection, _connection_key
+
+    key = (os.getpid(), settings.EMAIL_BACKEND)
+    if _connection is None or _connection_key != key:
+        _connection = get_connection()
+        _connection_key = key
+
+    _connection.open()
+    return _connection
+
+
+def _reset_connection():
+    global _connection
+
+    if _connection is not None:
+        try:
+            _connection.close()
+        except Exception:
+            logger.debug('Ignoring error closing email connection', exc_info=True)
+
+    _connection = None
+
+
+def _claim_batch(client, size):
+    """Move up to ``size`` of the oldest messages onto the processing list and return them."""
+    pipe = client.pipeline()
+    for _ in range(size):
+        pipe.rpoplpush(OUTBOX_KEY, PROCESSING_KEY)
+
+    return [raw for raw in pipe.execute() if raw is not None]
+
+
+def _ack(client, batch):
+    pipe = client.pipeline()
+    for raw in batch:
+        pipe.lrem(PROCESSING_KEY, 1, raw)
+    pipe.execute()
+
+
+def _send(raw):
+    payload = json.loads(raw)
+    message = EmailMessage(subject=payload['subject'], body=payload['body'],
+                           from_email=settings.DEFAULT_FROM_EMAIL, to=payload['to'])
+
+    try:
+        _get_connection().send_messages([message])
+        return None
+    except Exception:
+        # The server may have dropped an idle connection; retry once on a fresh one.
+        _reset_connection()
+
+    try:
+        _get_connection().send_messages([message])
+        return None
+    except Exception as exc:
+        _reset_connection()
+        return dict(payload, error=repr(exc), failed_at=time.time())
+
+
+def _extend_lock(client, lock):
+    """Push the drain lock's expiry out again; False if ``lock`` no longer holds it."""
+    return bool(client.register_script(_EXTEND_LOCK)(keys=[DRAIN_LOCK_KEY], args=[lock, settings.MAIL_DRAIN_LOCK_MS]))
+
+
+def send_batch(batch, heartbeat=None):
+    """
+    Send ``batch`` of raw outbox entries; return (sent, failed).
+    ``heartbeat`` is called before each message.
+    """
+    started = time.perf_counter()
+    dead = []
+
+    for raw in batch:
+        if heartbeat is not None:
+            heartbeat()
+
+        failure = _send(raw)
+        if failure is not None:
+            dead.append(failure)
+
+    if dead:
+        get_redis().lpush(DEAD_LETTER_KEY, *[json.dumps(failure) for failure in dead])
+
+    elapsed = (time.perf_counter() - started) * 1000
+    sent = len(batch) - len(dead)
+
+    metrics.incr('mail.sent', sent)
+    metrics.incr('mail.failed', len(dead))
+    metrics.timing('mail.batch', elapsed)
+    logger.info('Sent %d of %d messages in %.1fms', sent, len(batch), elapsed)
+
+    return sent, len(dead)
+
+
+def drain(batch_size=None, max_batches=None):
+    """
+    Send queued messages batch by batch until the outbox is empty or
+    ``max_batches`` have gone out. Only one drainer runs at a time.
+    """
+    batch_size = batch_size or settings.MAIL_BATCH_SIZE
+    max_batches = max_batches or settings.MAIL_MAX_BATCHES
+    client = get_redis()
+    lock = str(uuid.uuid4())
+
+    if not client.set(DRAIN_LOCK_KEY, lock, nx=True, px=settings.MAIL_DRAIN_LOCK_MS):
+        return {'sent': 0, 'failed': 0, 'batches': 0}
+
+    extended = time.monotonic()
+
+    def heartbeat():
+        nonlocal extended
+
+        # Extended a third of the way through its lifetime, so a slow message cannot outlast it.
+        if time.monotonic() - extended > settings.MAIL_DRAIN_LOCK_MS / 3000:
+            if not _extend_lock(client, lock):
+                raise LockLost()
+            extended = time.monotonic()
+
+    totals = {'sent': 0, 'failed': 0, 'batches': 0}
+    # Left behind by a drainer that died mid-batch, oldest last like the outbox.
+    batch = client.lrange(PROCESSING_KEY, 0, -1)[::-1]
+
+    try:
+        while totals['batches'] < max_batches:
+            batch = batch or _claim_batch(client, batch_size)
+            if not batch:
+                break
+
+            sent, failed = send_batch(batch, heartbeat)
+            _ack(client, batch)
+            batch = None
+
+            totals['sent'] += sent
+            totals['failed'] += failed
+            totals['batches'] += 1
+    except LockLost:
+        # The batch stays on the processing list for whoever holds the lock now.
+        logger.warning('Mail drain lock expired mid-batch, stopping')
+    finally:
+        client.register_script(_RELEASE_LOCK)(keys=[DRAIN_LOCK_KEY], args=[lock])
+
+    return totals
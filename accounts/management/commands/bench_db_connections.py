@@ -0,0 +1,50 @@
+from django.core.signals import request_finished, request_started
+from django.core.management.base import BaseCommand
+from django.db import connection
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from accounts import bench, metrics
+from accounts.models import User
+from accounts.views import UserViewSet
+
+
+class Command(BaseCommand):
+    help = 'Compare GET /v1/user/<id>/ latency with and without persistent database connections'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(email__endswith='@' + bench.BENCH_EMAIL_DOMAIN).first()
+        if user is None:
+            bench.seed_users(1)
+            user = User.objects.filter(email__endswith='@' + bench.BENCH_EMAIL_DOMAIN).first()
+
+        view = UserViewSet.as_view({'get': 'retrieve'})
+        factory = APIRequestFactory()
+
+        def request():
+            # Fire the request signals so Django's connection lifecycle runs
+            # exactly as it does under gunicorn.
+            request_started.send(sender=self.__class__)
+            try:
+                http = factory.get(f'/v1/user/{user.pk}/')
+                force_authenticate(http, user=user)
+                view(http, pk=str(user.pk)).render()
+            finally:
+                request_finished.send(sender=self.__class__)
+
+        original = connection.settings_dict['CONN_MAX_AGE']
+        try:
+            for label, max_age in (('new connection per request', 0), ('persistent connection', 300)):
+                connection.close()
+                connection.settings_dict['CONN_MAX_AGE'] = max_age
+                metrics.reset()
+
+                median, p99 = bench.measure(request, options['repeat'])
+                opened = metrics.snapshot()['counters'].get('db.connections_opened', 0)
+                self.stdout.write(f'{label:<28} median {median:7.2f} ms   p99 {p99:7.2f} ms   '
+                                  f'{opened} connections opened')
+        finally:
+            connection.close()
+            connection.settings_dict['CONN_MAX_AGE'] = original
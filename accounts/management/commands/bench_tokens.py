@@ -0,0 +1,49 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from accounts import bench
+from accounts.models import User
+from accounts.tokens import DatabaseTokenBackend, SignedTokenBackend
+
+
+class Command(BaseCommand):
+    help = 'Compare verify and reset confirm cost for the database and signed token backends'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=50)
+
+    def handle(self, *args, **options):
+        email = f'tokens@{bench.BENCH_EMAIL_DOMAIN}'
+        User.objects.filter(email=email).delete()
+        user = User.objects.create_user(email=email, password='benchmark')
+
+        try:
+            for backend in (DatabaseTokenBackend(), SignedTokenBackend()):
+                self.run(backend, user, 'VERIFY', lambda value: backend.confirm_user(value), options['repeat'])
+                self.run(backend, user, 'RESET', lambda value: backend.change_password(value, 'benchmark'),
+                         options['repeat'])
+        finally:
+            user.delete()
+
+    def run(self, backend, user, token_type, confirm, repeat):
+        timings = []
+        queries = 0
+
+        for _ in range(repeat):
+            User.objects.filter(pk=user.pk).update(is_verified=False)
+            user.refresh_from_db()
+            value = backend.issue(user, token_type)
+
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                confirm(value)
+                timings.append((time.perf_counter() - started) * 1000)
+
+            queries += len(captured)
+
+        self.stdout.write(f'{type(backend).__name__:<22} {token_type:<7} '
+                          f'median {statistics.median(timings):8.2f} ms   {queries / repeat:.1f} queries')
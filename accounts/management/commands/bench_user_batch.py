@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from accounts import bench
+from accounts.models import User
+from accounts.views import UserViewSet
+
+
+class Command(BaseCommand):
+    help = 'Compare N GET /v1/user/<id>/ calls with one POST /v1/user/batch/ for the same users'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--size', type=int, default=200, help='Users per batch')
+        parser.add_argument('--repeat', type=int, default=10)
+        parser.add_argument('--purge', action='store_true', help='Delete benchmark users when done')
+
+    def handle(self, *args, **options):
+        size = options['size']
+        users = User.objects.filter(email__endswith='@' + bench.BENCH_EMAIL_DOMAIN)
+
+        missing = size - users.count()
+        if missing > 0:
+            bench.seed_users(missing)
+
+        ids = [str(pk) for pk in users.values_list('id', flat=True)[:size]]
+        viewer = users.first()
+        factory = APIRequestFactory()
+        retrieve = UserViewSet.as_view({'get': 'retrieve'})
+        batch = UserViewSet.as_view({'post': 'batch'})
+
+        def singles():
+            for pk in ids:
+                request = factory.get(f'/v1/user/{pk}/')
+                force_authenticate(request, user=viewer)
+                retrieve(request, pk=pk).render()
+
+        def batched():
+            request = factory.post('/v1/user/batch/', {'ids': ids}, format='json')
+            force_authenticate(request, user=viewer)
+            batch(request).render()
+
+        for label, fn in ((f'{size} x GET /v1/user/<id>/', singles), ('1 x POST /v1/user/batch/', batched)):
+            with CaptureQueriesContext(connection) as queries:
+                fn()
+
+            median, p99 = bench.measure(fn, options['repeat'])
+            self.stdout.write(f'{label:<28} median {median:8.2f} ms   p99 {p99:8.2f} ms   '
+                              f'{len(queries.captured_queries)} queries')
+
+        if options['purge']:
+            bench.purge_users()
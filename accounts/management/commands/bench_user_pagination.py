@@ -0,0 +1,71 @@
+from urllib import parse
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.pagination import Cursor, LimitOffsetPagination
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from accounts import bench
+from accounts.models import User
+from accounts.pagination import UserCursorPagination
+from accounts.views import UserViewSet
+
+
+class Command(BaseCommand):
+    help = 'Compare keyset and OFFSET latency for page 1 and a deep page of GET /v1/user/'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help='Insert this many benchmark users first')
+        parser.add_argument('--page', type=int, default=10000)
+        parser.add_argument('--page-size', type=int, default=UserCursorPagination.page_size)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--purge', action='store_true', help='Delete benchmark users when done')
+
+    def handle(self, *args, **options):
+        if options['seed']:
+            bench.seed_users(options['seed'])
+
+        page_size = options['page_size']
+        total = User.objects.count()
+        page = min(options['page'], max(1, total // page_size))
+        self.stdout.write(f'{total} users, page size {page_size}, deep page {page}')
+
+        keyset_view = UserViewSet.as_view({'get': 'list'})
+        offset_view = UserViewSet.as_view({'get': 'list'}, pagination_class=LimitOffsetPagination)
+        factory = APIRequestFactory()
+        viewer = User.objects.order_by('date_joined', 'id').first()
+
+        def fetch(view, query):
+            request = factory.get('/v1/user/', query)
+            force_authenticate(request, user=viewer)
+            response = view(request)
+            response.render()
+
+            return response
+
+        # Build the cursor a client would hold after paging to the deep page.
+        boundary = User.objects.order_by('date_joined', 'id').values_list('date_joined', 'id', named=True)[
+            (page - 1) * page_size - 1] if page > 1 else None
+        paginator = UserCursorPagination()
+        paginator.base_url = 'http://testserver/v1/user/'
+        cursor = {}
+        if boundary is not None:
+            url = paginator.encode_cursor(Cursor(offset=0, reverse=False, position=paginator._position(boundary)))
+            cursor = dict(parse.parse_qsl(parse.urlparse(url).query))
+
+        rows = [
+            ('keyset page 1', lambda: fetch(keyset_view, {'page_size': page_size})),
+            (f'keyset page {page}', lambda: fetch(keyset_view, dict(cursor, page_size=page_size))),
+            ('offset page 1', lambda: fetch(offset_view, {'limit': page_size})),
+            (f'offset page {page}', lambda: fetch(offset_view, {'limit': page_size, 'offset': (page - 1) * page_size})),
+        ]
+        for label, fn in rows:
+            # Timing an error response would make any number look good.
+            response = fn()
+            if response.status_code != 200:
+                raise CommandError(f'{label} returned {response.status_code}: {response.data}')
+
+            median, p99 = bench.measure(fn, options['repeat'])
+            self.stdout.write(f'{label:<24} median {median:8.2f} ms   p99 {p99:8.2f} ms')
+
+        if options['purge']:
+            self.stdout.write(f'Purged {bench.purge_users()} benchmark users')
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from accounts import bench
+from accounts.models import User
+from accounts.renderers import FastJSONRenderer
+from accounts.serializers import UserRowSerializer, UserSerializer
+
+
+class Command(BaseCommand):
+    help = 'Compare rows/sec of the model serializer and the values() fast path used by GET /v1/user/'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000, help='Rows per page, as in ?page_size=')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--purge', action='store_true', help='Delete benchmark users when done')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+
+        missing = rows - User.objects.filter(email__endswith='@' + bench.BENCH_EMAIL_DOMAIN).count()
+        if missing > 0:
+            bench.seed_users(missing)
+
+        users = User.objects.filter(email__endswith='@' + bench.BENCH_EMAIL_DOMAIN).order_by('date_joined', 'id')
+
+        def model_path():
+            return JSONRenderer().render(UserSerializer(list(users[:rows]), many=True).data)
+
+        def fast_path():
+            page = list(users.values_list('id', 'email', 'date_joined', named=True)[:rows])
+            return FastJSONRenderer().render(UserRowSerializer(page, many=True).data)
+
+        assert len(model_path()) == len(fast_path())
+
+        for label, fn in (('ModelSerializer + JSONRenderer', model_path),
+                          ('values() + FastJSONRenderer', fast_path)):
+            median, p99 = bench.measure(fn, options['repeat'])
+            self.stdout.write(f'{label:<32} median {median:8.2f} ms   p99 {p99:8.2f} ms   '
+                              f'{rows / median * 1000:10.0f} rows/sec')
+
+        if options['purge']:
+            bench.purge_users()
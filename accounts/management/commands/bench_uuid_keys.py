@@ -0,0 +1,58 @@
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from accounts import ids
+
+
+class Command(BaseCommand):
+    help = 'Compare insert throughput and primary key index size of uuid4 and time-ordered uuid7 keys'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1000000)
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        rows, batch_size = options['rows'], options['batch_size']
+        column = connection.data_types['UUIDField']
+        baseline = None
+
+        for label, generate in (('uuid4', uuid.uuid4), ('uuid7', ids.uuid7)):
+            table = f'bench_uuid_{label}'
+
+            with connection.cursor() as cursor:
+                cursor.execute(f'DROP TABLE IF EXISTS {table}')
+                cursor.execute(f'CREATE TABLE {table} (id {column} PRIMARY KEY, n integer NOT NULL)')
+
+            started = time.perf_counter()
+            for offset in range(0, rows, batch_size):
+                count = min(batch_size, rows - offset)
+                values = []
+                for n in range(offset, offset + count):
+                    key = generate()
+                    values.extend((key if connection.features.has_native_uuid_field else key.hex, n))
+
+                with transaction.atomic(), connection.cursor() as cursor:
+                    cursor.execute(f'INSERT INTO {table} (id, n) VALUES ' + ', '.join(['(%s, %s)'] * count), values)
+            elapsed = time.perf_counter() - started
+
+            size = self.index_size(table)
+            with connection.cursor() as cursor:
+                cursor.execute(f'DROP TABLE {table}')
+
+            baseline = baseline or size
+            self.stdout.write(f'{label:<6} {rows / elapsed:10.0f} rows/sec   '
+                              f'primary key index {size / 2 ** 20:8.1f} MB ({size / baseline:.0%} of uuid4)')
+
+    def index_size(self, table):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SELECT pg_relation_size(indexrelid) FROM pg_index '
+                               'WHERE indrelid = %s::regclass AND indisprimary', [table])
+            else:
+                # Needs SQLite built with the dbstat virtual table, as the Python builds are.
+                cursor.execute('SELECT SUM(pgsize) FROM dbstat WHERE name = %s', [f'sqlite_autoindex_{table}_1'])
+
+            return cursor.fetchone()[0]
@@ -0,0 +1,39 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts import export
+
+
+class Command(BaseCommand):
+    help = 'Stream every user to a file or stdout as CSV or JSON Lines without loading the table into memory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', choices=export.FORMATS, default='csv')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--file', help='Write here instead of stdout')
+        parser.add_argument('--chunk-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        counted = [0]
+
+        def counting(rows):
+            for row in rows:
+                counted[0] += 1
+                yield row
+
+        started = time.perf_counter()
+        chunks = export.stream(options['output'], options['gzip'], counting(export.read_rows(options['chunk_size'])))
+
+        target = open(options['file'], 'wb') if options['file'] else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                target.write(chunk)
+        finally:
+            if options['file']:
+                target.close()
+
+        elapsed = time.perf_counter() - started
+        self.stderr.write(f'Exported {counted[0]} users in {elapsed:.1f}s '
+                          f'({counted[0] / max(elapsed, 1e-9):.0f} rows/sec)')
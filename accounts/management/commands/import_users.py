@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from accounts import importer
+
+
+class Command(BaseCommand):
+    help = ('Bulk import users from JSON Lines or CSV with email and either password or a pre-hashed '
+            'password_hash, via COPY into a staging table on Postgres')
+
+    def add_arguments(self, parser):
+        parser.add_argument('file', help="Path to the input, '-' for stdin")
+        parser.add_argument('--input', choices=importer.FORMATS, default=None,
+                            help='Input format, by default from the file extension')
+        parser.add_argument('--on-conflict', choices=importer.ON_CONFLICT, default=importer.SKIP,
+                            help='What to do with emails that are already registered')
+        parser.add_argument('--chunk-size', type=int, default=None)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+
+        def progress(stats):
+            elapsed = time.perf_counter() - started
+            self.stderr.write(f"{stats['read']} read, {stats['imported']} imported, {stats['skipped']} skipped, "
+                              f"{stats['invalid']} invalid ({stats['read'] / max(elapsed, 1e-9):.0f} rows/sec)")
+
+        def invalid(number, errors):
+            self.stderr.write(f"line {number}: {' '.join(errors)}")
+
+        records = importer.read_records(options['file'], options['input'])
+        stats = importer.import_users(records, options['chunk_size'], options['on_conflict'], progress, invalid)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"Imported {stats['imported']} of {stats['read']} users in {elapsed:.1f}s "
+                          f"({stats['read'] / max(elapsed, 1e-9):.0f} rows/sec)")
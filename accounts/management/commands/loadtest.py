@@ -0,0 +1,60 @@
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.core.management.base import BaseCommand
+
+from accounts import bench
+
+
+class Command(BaseCommand):
+    help = """
+    Fire concurrent requests at a running server and report requests/sec and
+    latency percentiles. To compare server modes, boot the API once with
+    SERVER=wsgi and once with SERVER=asgi at the same GUNICORN_WORKERS, then run
+    the same command against each.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('url')
+        parser.add_argument('--method', default='GET')
+        parser.add_argument('--data', help='JSON body; {n} is replaced with the request number')
+        parser.add_argument('--requests', type=int, default=2000)
+        parser.add_argument('--concurrency', type=int, default=32)
+
+    def handle(self, *args, **options):
+        local = threading.local()
+        body = options['data']
+
+        def fire(number):
+            session = getattr(local, 'session', None)
+            if session is None:
+                session = local.session = requests.Session()
+
+            data = body.replace('{n}', str(number)) if body else None
+            started = time.perf_counter()
+            response = session.request(options['method'], options['url'], data=data,
+                                       headers={'Content-Type': 'application/json'})
+            return (time.perf_counter() - started) * 1000, response.status_code
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            results = list(pool.map(fire, range(options['requests'])))
+        elapsed = time.perf_counter() - started
+
+        timings = sorted(ms for ms, _ in results)
+        statuses = {}
+        for _, code in results:
+            statuses[code] = statuses.get(code, 0) + 1
+
+        self.stdout.write(json.dumps({
+            'requests': len(results),
+            'concurrency': options['concurrency'],
+            'rps': round(len(results) / elapsed, 1),
+            'p50_ms': round(statistics.median(timings), 2),
+            'p99_ms': round(bench.percentile(timings, 0.99), 2),
+            'statuses': statuses,
+        }, indent=2))
@@ -0,0 +1,106 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounts import authentication, shards
+from accounts.models import Token, User, UserTombstone
+
+
+class Command(BaseCommand):
+    help = 'Move users and their tokens onto the shard their email hashes to, e.g. after adding a shard'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would move')
+
+    def handle(self, *args, **options):
+        if not shards.enabled():
+            self.stdout.write('Only one shard is configured, nothing to rebalance')
+            return
+
+        started = time.perf_counter()
+        scanned = moved = skipped = 0
+
+        for source in shards.aliases():
+            last = None
+            before = moved
+
+            while True:
+                page = User.objects.using(source).order_by('pk')
+                if last is not None:
+                    page = page.filter(pk__gt=last)
+
+                batch = list(page[:options['batch_size']])
+                if not batch:
+                    break
+
+                last = batch[-1].pk
+                scanned += len(batch)
+
+                targets = {}
+                for user in batch:
+                    target = shards.db_for_email(user.email)
+                    if target != source:
+                        targets.setdefault(target, []).append(user)
+
+                for target, users in targets.items():
+                    users, held = self.split_held(users, source)
+                    skipped += len(held)
+
+                    if not options['dry_run']:
+                        self.move(users, source, target)
+                    moved += len(users)
+
+            self.stdout.write(f'{source}: {moved - before} users to other shards')
+
+        elapsed = time.perf_counter() - started
+        verb = 'would move' if options['dry_run'] else 'moved'
+        self.stdout.write(f'Scanned {scanned} users, {verb} {moved} in {elapsed:.1f}s')
+
+        if skipped:
+            self.stdout.write(f'{skipped} staff users or users with group or permission rows were left in '
+                              f'place; lookups still find them by fanning out')
+
+    def split_held(self, users, source):
+        """
+        Group and permission ids differ between shards and staff users own
+        admin log entries, so those users can't be moved safely. They stay
+        where they are.
+        """
+        ids = [user.pk for user in users]
+        held = {user.pk for user in users if user.is_staff}
+
+        for through in (User.groups.through, User.user_permissions.through):
+            held.update(through.objects.using(source).filter(user_id__in=ids).values_list('user_id', flat=True))
+
+        return [user for user in users if user.pk not in held], [user for user in users if user.pk in held]
+
+    def move(self, users, source, target):
+        """
+        Copy ``users`` and their tokens to ``target``, then delete them from
+        ``source``. A crash in between leaves both copies, and the next run
+        replaces the one on ``target``, so rows are never lost.
+        """
+        if not users:
+            return
+
+        ids = [user.pk for user in users]
+        tokens = list(Token.objects.using(source).filter(user_id__in=ids))
+
+        with transaction.atomic(using=target):
+            Token.objects.using(target).filter(user_id__in=ids).delete()
+            User.objects.using(target).filter(pk__in=ids).delete()
+            # Clearing a previous run's copies sends post_delete, which tombstones them.
+            UserTombstone.objects.using(target).filter(pk__in=ids).delete()
+            User.objects.using(target).bulk_create(users)
+            Token.objects.using(target).bulk_create(tokens)
+
+        with transaction.atomic(using=source):
+            Token.objects.using(source).filter(user_id__in=ids).delete()
+            User.objects.using(source).filter(pk__in=ids).delete()
+            # The users moved, they weren't deleted; keep them out of the changes feed.
+            UserTombstone.objects.using(source).filter(pk__in=ids).delete()
+
+        for user in users:
+            authentication.invalidate(user.pk, user.email)
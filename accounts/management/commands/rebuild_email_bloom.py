@@ -0,0 +1,38 @@
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from accounts import bloom, shards
+from accounts.models import User
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the Bloom filter of registered emails from the user table and report its error rate and size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sample', type=int, default=100000,
+                            help='Unregistered addresses tested to measure the false positive rate')
+
+    def handle(self, *args, **options):
+        def emails():
+            for alias in (shards.aliases() if shards.enabled() else [None]):
+                yield from User.objects.using(alias).values_list('email', flat=True).iterator(
+                    chunk_size=settings.EXPORT_CHUNK_SIZE)
+
+        started = time.perf_counter()
+        data, count = bloom.rebuild(emails())
+        elapsed = time.perf_counter() - started
+
+        bits, hashes = bloom.size()
+        sample = options['sample']
+        false_positives = sum(bloom._test(data, bloom.positions(f'{uuid.uuid4().hex}@example.invalid', bits, hashes))
+                              for _ in range(sample))
+
+        self.stdout.write(f'Added {count} emails in {elapsed:.1f}s')
+        self.stdout.write(f'{bits} bits, {hashes} hashes, {len(data) / 2 ** 20:.1f} MiB in Redis and in each process '
+                          f'(fixed by the capacity of {settings.EMAIL_BLOOM_CAPACITY}, not by the number of users)')
+        self.stdout.write(f'False positive rate: {bloom.false_positive_rate(count, bits, hashes):.6f} expected, '
+                          f'{false_positives / max(sample, 1):.6f} measured over {sample} unregistered addresses, '
+                          f'{settings.EMAIL_BLOOM_ERROR_RATE} at capacity')
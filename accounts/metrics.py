@@ -0,0 +1,48 @@
+"""
+Minimal per-process metrics registry. Each gunicorn/celery worker keeps its
+own counters, gauges and timings; ``snapshot`` reports them with the pid.
+"""
+import collections
+import os
+import threading
+
+_lock = threading.Lock()
+_counters = collections.Counter()
+_gauges = {}
+_timings = {}
+
+
+def incr(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+
+def gauge(name, value):
+    with _lock:
+        _gauges[name] = value
+
+
+def timing(name, milliseconds):
+    with _lock:
+        count, total, peak = _timings.get(name, (0, 0.0, 0.0))
+        _timings[name] = (count + 1, total + milliseconds, max(peak, milliseconds))
+
+
+def snapshot():
+    with _lock:
+        return {
+            'pid': os.getpid(),
+            'counters': dict(_counters),
+            'gauges': dict(_gauges),
+            'timings': {
+                name: {'count': count, 'mean_ms': total / count, 'max_ms': peak}
+                for name, (count, total, peak) in _timings.items()
+            },
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _timings.clear()
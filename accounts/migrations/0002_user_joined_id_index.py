@@ -0,0 +1,17 @@
+# Generated by Django 2.1 on 2026-10-18 03:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['date_joined', 'id'], name='accounts_user_joined_id_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.1 on 2026-10-18 03:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_user_joined_id_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='token',
+            index=models.Index(fields=['expires'], name='accounts_token_expires_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='token',
+            index=models.Index(fields=['user', 'type'], name='accounts_token_user_type_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.1 on 2026-10-18 03:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_token_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserTombstone',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('deleted_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['last_updated', 'id'], name='accounts_user_updated_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='usertombstone',
+            index=models.Index(fields=['deleted_at', 'id'], name='accounts_tombstone_deleted_idx'),
+        ),
+    ]
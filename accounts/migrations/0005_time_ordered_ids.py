@@ -0,0 +1,29 @@
+# Generated by Django 2.1 on 2026-10-18 03:45
+
+import accounts.ids
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0004_user_changes_feed'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='role',
+            name='id',
+            field=models.UUIDField(default=accounts.ids.uuid7, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='token',
+            name='id',
+            field=models.UUIDField(default=accounts.ids.uuid7, editable=False, primary_key=True, serialize=False),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='id',
+            field=models.UUIDField(default=accounts.ids.uuid7, editable=False, primary_key=True, serialize=False),
+        ),
+    ]
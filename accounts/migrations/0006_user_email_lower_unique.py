@@ -0,0 +1,135 @@
+# Generated by Django 2.1 on 2026-10-18 04:10
+
+import logging
+
+import redis
+from django.conf import settings
+from django.db import IntegrityError, migrations, transaction
+from django.db.models import Count, F
+from django.db.models.functions import Lower
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+INDEX = 'accounts_user_email_lower_uniq'
+BATCH_SIZE = 1000
+ATTEMPTS = 3
+
+
+def drop_cached_state(users):
+    """
+    Drop the auth and permission cache entries of ``users``, (id, email)
+    pairs, and tell every process to drop its local copy. The key layout is
+    spelled out here as it was when this migration was written, rather than
+    importing accounts.authentication and accounts.permission_cache.
+    """
+    if not users:
+        return
+
+    try:
+        client = redis.StrictRedis.from_url(settings.REDIS_CACHE_URL, socket_timeout=settings.REDIS_CACHE_TIMEOUT,
+                                            socket_connect_timeout=settings.REDIS_CACHE_TIMEOUT)
+        pipe = client.pipeline()
+        for pk, email in users:
+            pipe.delete(f'accounts:auth:email:{email}', f'accounts:auth:id:{pk}', f'accounts:perms:{pk}')
+            pipe.publish('accounts:auth:invalidate', email)
+        pipe.execute()
+    except redis.RedisError:
+        logger.warning('Could not drop the cached state of %d deactivated duplicates; it expires within '
+                       'AUTH_CACHE_REDIS_TTL and PERMISSION_CACHE_TTL', len(users), exc_info=True)
+
+
+def deduplicate(apps, schema_editor):
+    """
+    Keep one user per case-insensitive email, the one that last logged in or
+    else the oldest, and deactivate the rest under a unique placeholder email.
+    Their rows and tokens stay for a manual merge. Each batch of emails is its
+    own short transaction, so no lock is held across the table, and the cached
+    auth state of the users it deactivated is dropped once it commits.
+    """
+    User = apps.get_model('accounts', 'User')
+    users = User.objects.using(schema_editor.connection.alias).annotate(normalized=Lower('email'))
+
+    duplicated = list(users.values('normalized').annotate(count=Count('id')).filter(count__gt=1)
+                      .values_list('normalized', flat=True))
+
+    for start in range(0, len(duplicated), BATCH_SIZE):
+        batch = duplicated[start:start + BATCH_SIZE]
+        rows = users.filter(normalized__in=batch) \
+            .order_by('normalized', F('last_login').desc(nulls_last=True), 'date_joined') \
+            .values_list('id', 'email', 'normalized')
+
+        deactivated = []
+        with transaction.atomic(using=schema_editor.connection.alias):
+            kept = set()
+            for pk, email, normalized in rows:
+                if normalized not in kept:
+                    kept.add(normalized)
+                    continue
+
+                User.objects.using(schema_editor.connection.alias).filter(pk=pk) \
+                    .update(email=f'duplicate-{pk.hex}-{email}'[:255], is_active=False, last_updated=timezone.now())
+                deactivated.append((pk, email))
+
+        # update() sends no post_save, so the caches are not told otherwise.
+        drop_cached_state(deactivated)
+
+
+def index_valid(schema_editor):
+    """True or False for a valid or INVALID index, None when there is none."""
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid '
+                       'WHERE c.relname = %s', [INDEX])
+        row = cursor.fetchone()
+
+    return None if row is None else row[0]
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        schema_editor.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS {INDEX} ON accounts_user (lower(email))')
+        return
+
+    # CONCURRENTLY builds the index without blocking writes; it cannot run in a
+    # transaction. Processes still on the previous release can insert a case
+    # variant between deduplicate and the build, which then fails and leaves an
+    # INVALID index: it enforces nothing, cannot be the importer's ON CONFLICT
+    # arbiter and would be skipped by IF NOT EXISTS. So an invalid index is
+    # dropped and the duplicates resolved again before each retry.
+    for _ in range(ATTEMPTS):
+        valid = index_valid(schema_editor)
+        if valid:
+            return
+
+        if valid is not None:
+            schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {INDEX}')
+            deduplicate(apps, schema_editor)
+
+        try:
+            schema_editor.execute(f'CREATE UNIQUE INDEX CONCURRENTLY {INDEX} ON accounts_user (lower(email))')
+            return
+        except IntegrityError:
+            continue
+
+    schema_editor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {INDEX}')
+    raise RuntimeError(f'{INDEX} could not be built: case-variant duplicate emails kept being registered while '
+                       f'it was. Stop the processes running the previous release and migrate again.')
+
+
+def drop_index(apps, schema_editor):
+    concurrently = 'CONCURRENTLY ' if schema_editor.connection.vendor == 'postgresql' else ''
+    schema_editor.execute(f'DROP INDEX {concurrently}IF EXISTS {INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('accounts', '0005_time_ordered_ids'),
+    ]
+
+    operations = [
+        migrations.RunPython(deduplicate, migrations.RunPython.noop),
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 2.1 on 2026-10-18 04:53
+
+from django.db import migrations
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_user_email_lower_unique'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='role',
+            name='last_updated',
+            field=django_extensions.db.fields.ModificationDateTimeField(auto_now=True, help_text='Auto update with timestamp when changes are made'),
+        ),
+    ]
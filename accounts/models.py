@@ -1,14 +1,19 @@
 import datetime
-import uuid
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models.functions import Lower
 from django_extensions.db.fields import ModificationDateTimeField
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin, BaseUserManager
 
+from accounts import bloom, hashing, ids, shards
 from accounts.constants import TOKEN_TYPES
 
+# email__lower=value.lower() matches case-insensitively on accounts_user_email_lower_uniq,
+# where email__iexact compiles to UPPER() and would scan the table.
+models.EmailField.register_lookup(Lower)
+
 
 class BaseModel(models.Model):
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=ids.uuid7, editable=False)
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
@@ -22,12 +27,16 @@ class Role(models.Model):
         return self.name
 
     id = models.UUIDField(primary_key=True,
-                          default=uuid.uuid4,
+                          default=ids.uuid7,
                           editable=False)
 
     name = models.CharField(max_length=100,
                             help_text="Enter a name for this type of role")
 
+    last_updated = ModificationDateTimeField(
+        help_text="Auto update with timestamp when changes are made"
+    )
+
 
 class UserManager(BaseUserManager):
     use_in_migrations = True
@@ -36,7 +45,7 @@ class UserManager(BaseUserManager):
         if not email:
             raise ValueError('Users must have an email address')
 
-        if self.model.objects.filter(email=email).exists():
+        if bloom.might_exist(email) and shards.locate(self.model.objects, email__lower=email.lower()).exists():
             raise ValueError('A user already exists with that email address')
 
         user = self.model(
@@ -48,6 +57,35 @@ class UserManager(BaseUserManager):
         user.save(using=self._db)
         return user
 
+    def bulk_insert(self, users, batch_size=None, using=None):
+        """
+        Insert ``users`` and return the set of primary keys that made it in.
+        Used by bulk registration and imports, which send no post_save.
+        """
+        using = using or self._db
+        try:
+            with transaction.atomic(using=using):
+                self.db_manager(using).bulk_create(users, batch_size=batch_size)
+            return {user.pk for user in users}
+        except IntegrityError:
+            pass
+
+        # A concurrent registration claimed one of the emails; fall back to
+        # inserting row by row so only the conflicting rows are lost.
+        created = set()
+        for user in users:
+            try:
+                with transaction.atomic(using=using):
+                    user.save(force_insert=True, using=using)
+                created.add(user.pk)
+            except IntegrityError:
+                pass
+
+        return created
+
+    def get_by_natural_key(self, username):
+        return shards.get(self.get_queryset(), **{f'{self.model.USERNAME_FIELD}__lower': (username or '').lower()})
+
     def create_user(self, email, password=None, **extra_fields):
         extra_fields.setdefault('is_staff', False)
         extra_fields.setdefault('is_superuser', False)
@@ -62,7 +100,7 @@ class UserManager(BaseUserManager):
 
 class User(PermissionsMixin, AbstractBaseUser):
     id = models.UUIDField(primary_key=True,
-                          default=uuid.uuid4,
+                          default=ids.uuid7,
                           editable=False)
 
     email = models.EmailField(verbose_name='email address',
@@ -88,21 +126,73 @@ class User(PermissionsMixin, AbstractBaseUser):
 
     USERNAME_FIELD = 'email'
 
+    class Meta:
+        # Emails are also unique case-insensitively, through the lower(email) index
+        # accounts_user_email_lower_uniq that migration 0006 creates outside the model state.
+        indexes = [
+            models.Index(fields=['date_joined', 'id'], name='accounts_user_joined_id_idx'),
+            models.Index(fields=['last_updated', 'id'], name='accounts_user_updated_id_idx'),
+        ]
+
     def get_short_name(self):
         """Returns the short name for the user."""
 
         return self.email
 
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            # Carry the email's shard bucket in the id so lookups by id route directly.
+            self.id = shards.tag(self.id, shards.bucket_for_email(self.email))
+
+        super().save(*args, **kwargs)
+
+    def set_password(self, raw_password):
+        self.password = hashing.make_password(raw_password)
+        self._password = raw_password
+
+    def check_password(self, raw_password):
+        """Verify on the hashing executor; see accounts.hashing."""
+
+        def setter(raw_password):
+            self.set_password(raw_password)
+            # Password hash upgrades shouldn't be considered password changes.
+            self._password = None
+            self.save(update_fields=['password'])
+
+        return hashing.check_password(raw_password, self.password, setter)
+
+
+class UserTombstone(models.Model):
+    """Marks a deleted user for the changes feed, see accounts.changes."""
+
+    id = models.UUIDField(primary_key=True, editable=False)
+    deleted_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['deleted_at', 'id'], name='accounts_tombstone_deleted_idx'),
+        ]
+
 
 class Token(models.Model):
     user = models.ForeignKey(User, on_delete=models.PROTECT)
-    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    id = models.UUIDField(primary_key=True, default=ids.uuid7, editable=False)
     type = models.CharField(max_length=50, choices=TOKEN_TYPES)
     expires = models.DateTimeField()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['expires'], name='accounts_token_expires_idx'),
+            models.Index(fields=['user', 'type'], name='accounts_token_user_type_idx'),
+        ]
+
     def save(self, hours=24, force_insert=False, force_update=False, using=None, update_fields=None):
         self.expires = datetime.datetime.now() + datetime.timedelta(hours=hours)
 
+        if self._state.adding:
+            # Tokens live on their user's shard; tag the id with its bucket.
+            self.id = shards.tag(self.id, shards.bucket_for_email(self.user.email))
+
         super().save()
 
     def __str__(self):
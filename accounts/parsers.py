@@ -0,0 +1,31 @@
+import json
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class JSONLinesParser(BaseParser):
+    """
+    Parses a JSON Lines (newline delimited JSON) body into a list, one item
+    per non-blank line, reading the stream a line at a time.
+    """
+
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        rows = []
+
+        for number, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+
+            try:
+                rows.append(json.loads(line.decode(encoding)))
+            except ValueError as exc:
+                raise ParseError(f'JSON parse error on line {number} - {exc}')
+
+        return rows
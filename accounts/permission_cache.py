@@ -0,0 +1,175 @@
+"""
+Caches behind permission checks: the Role table in every process and each
+user's compiled permission set in Redis.
+
+Roles are a handful of rows that rarely change, so the whole table is held
+in-process. It is reloaded after a Role is saved or deleted anywhere (through
+the invalidation channel) or after ROLE_CACHE_TTL seconds, and users built
+from the auth cache get their role from it instead of a query.
+
+CachedModelBackend keeps the result of ModelBackend.get_all_permissions, the
+union of the user's own and group permissions, in Redis. A user's entry is
+dropped when the user or their group and permission rows change. Changes to
+a group's permissions bump a generation that retires every entry at once, as
+the group's members are not known without a query.
+"""
+import copy
+import json
+import logging
+import os
+import threading
+import time
+
+import redis
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+
+from accounts import metrics
+from accounts.cache import get_redis
+from accounts.models import Role
+
+logger = logging.getLogger(__name__)
+
+ROLES_CHANNEL = 'accounts:roles:invalidate'
+GENERATION_KEY = 'accounts:perms:generation'
+
+_roles = None
+_roles_lock = threading.Lock()
+
+_listener_pid = None
+_listener_lock = threading.Lock()
+
+
+def _perms_key(user_id):
+    return f'accounts:perms:{user_id}'
+
+
+def get_role(role_id):
+    """The Role with ``role_id`` from the in-process table, or None."""
+    global _roles
+
+    if role_id is None:
+        return None
+
+    _ensure_listener()
+
+    def stale(roles):
+        return roles is None or roles[1] < time.monotonic() - settings.ROLE_CACHE_TTL or role_id not in roles[0]
+
+    roles = _roles
+    if stale(roles):
+        with _roles_lock:
+            # Another thread may have reloaded the table while this one waited.
+            roles = _roles
+            if stale(roles):
+                roles = _roles = {role.id: role for role in Role.objects.all()}, time.monotonic()
+
+    role = roles[0].get(role_id)
+
+    # Callers get their own instance, so nothing they do leaks into the cache.
+    return copy.copy(role) if role is not None else None
+
+
+def invalidate_roles():
+    """Drop the Role table here and, through the invalidation channel, in every other process."""
+    global _roles
+
+    _roles = None
+
+    try:
+        get_redis().publish(ROLES_CHANNEL, 'roles')
+    except redis.RedisError:
+        logger.warning('Role cache invalidation failed', exc_info=True)
+
+
+def _on_invalidation(message):
+    global _roles
+
+    _roles = None
+
+
+def _ensure_listener():
+    """Subscribe this process to the roles channel, once per pid like accounts.authentication."""
+    global _listener_pid
+
+    if _listener_pid == os.getpid():
+        return
+
+    with _listener_lock:
+        if _listener_pid == os.getpid():
+            return
+
+        try:
+            pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{ROLES_CHANNEL: _on_invalidation})
+            pubsub.run_in_thread(sleep_time=1, daemon=True)
+        except redis.RedisError:
+            logger.warning('Role cache listener failed to start', exc_info=True)
+            return
+
+        _listener_pid = os.getpid()
+
+
+def get_permissions(user, compile_permissions):
+    """
+    The user's compiled permission set from Redis, or ``compile_permissions()``
+    stored there for next time.
+    """
+    key = _perms_key(user.pk)
+
+    try:
+        generation, raw = get_redis().pipeline().get(GENERATION_KEY).get(key).execute()
+    except redis.RedisError:
+        logger.warning('Permission cache read failed for %s', user.pk, exc_info=True)
+        return compile_permissions()
+
+    generation = int(generation or 0)
+
+    if raw is not None:
+        entry = json.loads(raw)
+        if entry['generation'] == generation:
+            metrics.incr('permission_cache.hit')
+            return set(entry['permissions'])
+
+    metrics.incr('permission_cache.miss')
+    permissions = compile_permissions()
+
+    try:
+        # Stamped with the generation read before compiling, so a bump meanwhile retires it.
+        get_redis().set(key, json.dumps({'generation': generation, 'permissions': sorted(permissions)}),
+                        ex=settings.PERMISSION_CACHE_TTL)
+    except redis.RedisError:
+        logger.warning('Permission cache write failed for %s', user.pk, exc_info=True)
+
+    return permissions
+
+
+def invalidate_user(*user_ids):
+    if not user_ids:
+        return
+
+    try:
+        get_redis().delete(*[_perms_key(user_id) for user_id in user_ids])
+    except redis.RedisError:
+        logger.warning('Permission cache invalidation failed for %s', user_ids, exc_info=True)
+
+
+def invalidate_all():
+    try:
+        get_redis().incr(GENERATION_KEY)
+    except redis.RedisError:
+        logger.warning('Permission cache generation bump failed', exc_info=True)
+
+
+class CachedModelBackend(ModelBackend):
+    """ModelBackend whose has_perm, has_module_perms and get_all_permissions read the permission cache."""
+
+    def get_all_permissions(self, user_obj, obj=None):
+        if not user_obj.is_active or user_obj.is_anonymous or obj is not None:
+            return set()
+
+        if not hasattr(user_obj, '_perm_cache'):
+            user_obj._perm_cache = get_permissions(
+                user_obj, lambda: super(CachedModelBackend, self).get_all_permissions(user_obj))
+
+        return user_obj._perm_cache
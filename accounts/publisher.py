@@ -0,0 +1,75 @@
+"""
+Hand Celery publishes to a background thread.
+
+With CELERY_PUBLISH_IN_BACKGROUND on, request threads put (task, args)
+on a bounded in-process queue and return without waiting on the broker
+round trip; a daemon thread per worker process does the actual publish. If the
+queue is full we fall back to publishing inline rather than dropping work.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+
+from accounts import metrics
+
+logger = logging.getLogger(__name__)
+
+_queue = None
+_pid = None
+_lock = threading.Lock()
+
+
+def _drain(pending):
+    while True:
+        task, args, kwargs = pending.get()
+        try:
+            task.apply_async(args, kwargs)
+        except Exception:
+            logger.exception('Failed to publish %s', task.name)
+            metrics.incr('publisher.failed')
+        finally:
+            pending.task_done()
+
+
+def _get_queue():
+    global _queue, _pid
+
+    with _lock:
+        if _queue is None or _pid != os.getpid():
+            _queue = queue.Queue(maxsize=settings.CELERY_PUBLISH_QUEUE_SIZE)
+            _pid = os.getpid()
+            threading.Thread(target=_drain, args=(_queue,), name='celery-publisher', daemon=True).start()
+
+        return _queue
+
+
+def publish(task, *args, **kwargs):
+    if not settings.CELERY_PUBLISH_IN_BACKGROUND:
+        task.delay(*args, **kwargs)
+        return
+
+    pending = _get_queue()
+    try:
+        pending.put_nowait((task, args, kwargs))
+    except queue.Full:
+        metrics.incr('publisher.overflow')
+        task.delay(*args, **kwargs)
+        return
+
+    metrics.gauge('publisher.queue_depth', pending.qsize())
+
+
+@atexit.register
+def flush(timeout=5):
+    """Give queued publishes up to ``timeout`` seconds to go out."""
+    if _queue is None or _pid != os.getpid():
+        return
+
+    deadline = time.monotonic() + timeout
+    while _queue.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.01)
@@ -0,0 +1,115 @@
+"""
+Bulk user registration.
+
+Rows are processed in chunks: one set-based query per chunk finds emails
+that are already registered, passwords are hashed in parallel on the hashing
+executor, new users are inserted with bulk_create and verification messages
+go out as one batched task per chunk. With sharding on, the existing-email
+query runs on every shard in parallel and each user is inserted on its own
+shard.
+"""
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+
+from accounts import bloom, hashing, publisher, shards, tasks
+from accounts.models import User
+
+CREATED = 'created'
+EXISTS = 'exists'
+DUPLICATE = 'duplicate'
+INVALID = 'invalid'
+
+
+def register_users(rows, chunk_size=None, batch_size=None):
+    """
+    Register every row of ``rows`` (dicts with ``email`` and ``password``) and
+    return one result per row, in input order.
+    """
+    chunk_size = chunk_size or settings.BULK_REGISTER_CHUNK_SIZE
+    batch_size = batch_size or settings.BULK_REGISTER_BATCH_SIZE
+    seen = set()
+    results = []
+
+    for start in range(0, len(rows), chunk_size):
+        results.extend(_register_chunk(rows[start:start + chunk_size], start, seen, batch_size))
+
+    return results
+
+
+def _clean(row):
+    if not isinstance(row, dict):
+        return None, None, ['Expected an object with email and password.']
+
+    errors = []
+    email = row.get('email') or ''
+    password = row.get('password')
+
+    if not isinstance(email, str):
+        errors.append('The email must be a string.')
+        email = None
+    else:
+        email = User.objects.normalize_email(email)
+        try:
+            validate_email(email)
+        except ValidationError as exc:
+            errors.extend(exc.messages)
+
+    if not isinstance(password, str) or not password:
+        errors.append('A password is required.')
+
+    return email, password, errors
+
+
+def _register_chunk(chunk, offset, seen, batch_size):
+    results = []
+    pending = []
+
+    for index, row in enumerate(chunk, offset):
+        email, password, errors = _clean(row)
+        result = {'index': index, 'email': email}
+        results.append(result)
+
+        if errors:
+            result.update(status=INVALID, errors=errors)
+        elif email.lower() in seen:
+            result['status'] = DUPLICATE
+        else:
+            seen.add(email.lower())
+            pending.append((result, email, password))
+
+    emails = [email.lower() for _, email, _ in pending]
+    found = shards.fan_out(
+        lambda alias: list(User.objects.using(alias).filter(email__lower__in=emails).values_list('email', flat=True)))
+    existing = {email.lower() for matches in found.values() for email in matches}
+
+    for result, email, _ in pending:
+        if email.lower() in existing:
+            result['status'] = EXISTS
+
+    pending = [entry for entry in pending if entry[1].lower() not in existing]
+    encoded = hashing.get_executor().map(hashers.make_password, [password for _, _, password in pending])
+    users = [User(email=email, password=password) for (_, email, _), password in zip(pending, encoded)]
+
+    by_shard = {}
+    for user in users:
+        user.id = shards.tag(user.id, shards.bucket_for_email(user.email))
+        by_shard.setdefault(shards.db_for_email(user.email), []).append(user)
+
+    created = set()
+    for alias, group in by_shard.items():
+        created |= User.objects.bulk_insert(group, batch_size, alias)
+
+    for (result, _, _), user in zip(pending, users):
+        if user.pk in created:
+            result.update(status=CREATED, id=str(user.pk))
+        else:
+            result['status'] = EXISTS
+
+    recipients = [user.email for user in users if user.pk in created]
+    if recipients:
+        bloom.add(*recipients)
+        publisher.publish(tasks.message_batch, 'verify', recipients=recipients)
+
+    return results
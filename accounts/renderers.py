@@ -0,0 +1,25 @@
+"""
+JSON rendering through orjson, which encodes UUIDs, datetimes and dicts in
+native code rather than calling back into Python for every UUID the way the
+stdlib encoder does. Output is UTF-8 rather than ASCII-escaped, which is
+equally valid JSON.
+"""
+import orjson
+from rest_framework import renderers
+from rest_framework.utils import encoders
+
+_encoder = encoders.JSONEncoder()
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        # Pretty printing is for people; leave it to the stock renderer.
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Anything orjson doesn't know (lazy translations, Decimal, ...) goes
+        # through DRF's encoder, so the output matches JSONRenderer.
+        return orjson.dumps(data, default=_encoder.default, option=orjson.OPT_UTC_Z)
@@ -0,0 +1,65 @@
+"""
+Conditional GET validators and the rendered-response cache for
+GET /v1/user/<id>/, see UserViewSet.retrieve.
+
+Both validators derive from User.last_updated and, since responses can embed
+the role's name, from the role's last_updated. Cached bodies live in one Redis
+hash per user, keyed by variant (ETag, media type and query string), so a
+changed row can never be answered from an older entry and a save drops every
+entry with a single DEL.
+"""
+import calendar
+import logging
+
+import redis
+from django.conf import settings
+from django.utils.http import quote_etag
+
+from accounts import metrics
+from accounts.cache import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+def validators(last_updated, role_updated=None):
+    """Return the (ETag, Last-Modified timestamp) pair for a row's and its role's last_updated."""
+    versions = [last_updated] if role_updated is None else [last_updated, role_updated]
+    etag = quote_etag('-'.join('%x' % int(version.timestamp() * 1000000) for version in versions))
+
+    return etag, calendar.timegm(max(versions).utctimetuple())
+
+
+def _key(pk):
+    return f'accounts:user:response:{pk}'
+
+
+def get_response(pk, variant):
+    try:
+        body = get_redis().hget(_key(pk), variant)
+    except redis.RedisError:
+        logger.warning('Response cache read failed for %s', pk, exc_info=True)
+        return None
+
+    metrics.incr('user_response_cache.hit' if body is not None else 'user_response_cache.miss')
+
+    return body
+
+
+def store_response(pk, variant, body):
+    try:
+        get_redis().pipeline() \
+            .hset(_key(pk), variant, body) \
+            .expire(_key(pk), settings.USER_RESPONSE_CACHE_TTL) \
+            .execute()
+    except redis.RedisError:
+        logger.warning('Response cache write failed for %s', pk, exc_info=True)
+
+
+def invalidate(pk):
+    if not settings.USER_RESPONSE_CACHE:
+        return
+
+    try:
+        get_redis().delete(_key(pk))
+    except redis.RedisError:
+        logger.warning('Response cache invalidation failed for %s', pk, exc_info=True)
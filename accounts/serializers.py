@@ -1,12 +1,83 @@
+import operator
+
 from rest_framework import serializers
-from .models import User
+from rest_framework.exceptions import ValidationError
+
+from accounts import bloom, shards
+from .models import Role, User
+
+
+class SparseFieldsMixin(object):
+    """
+    Support for ``?fields=a,b``. Meta.sparse_fields whitelists what may be
+    asked for, Meta.default_fields is what callers get without the parameter
+    and Meta.expandable names nested relations with the columns they read.
+    Write-only fields are always kept so input is still accepted.
+    """
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None) or self.Meta.default_fields
+        super().__init__(*args, **kwargs)
+
+        for name, field in list(self.fields.items()):
+            if name not in fields and not field.write_only:
+                self.fields.pop(name)
+
+    @classmethod
+    def parse_fields(cls, value):
+        """Validate a ``?fields=`` value against the whitelist; None means the defaults."""
+        if value is None:
+            return None
+
+        fields = tuple(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+        unknown = [name for name in fields if name not in cls.Meta.sparse_fields]
+
+        if unknown or not fields:
+            raise ValidationError({'fields': f'Choose from {", ".join(cls.Meta.sparse_fields)}.'})
+
+        return fields
+
+    @classmethod
+    def prune(cls, queryset, fields=None):
+        """Load only the columns ``fields`` need, joining expanded relations in the same query."""
+        fields = fields or cls.Meta.default_fields
+        related = [name for name in fields if name in cls.Meta.expandable]
+        columns = [name for name in fields if name not in related]
+
+        for name in related:
+            columns += [name] + [f'{name}__{column}' for column in cls.Meta.expandable[name]]
+
+        return queryset.select_related(*related).only(*columns)
+
+
+class RoleSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Role
+        fields = ('id', 'name', )
+
 
+class UserSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    role = RoleSerializer(read_only=True)
 
-class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
-        fields = ('id', 'email', 'password', )
-        extra_kwargs = {'password': {'write_only': True}}
+        fields = ('id', 'email', 'password', 'is_active', 'is_verified', 'date_joined', 'last_updated', 'role', )
+        read_only_fields = ('is_active', 'is_verified', 'date_joined', 'last_updated', )
+        # Uniqueness is checked case-insensitively in validate_email instead.
+        extra_kwargs = {'password': {'write_only': True}, 'email': {'validators': []}}
+        default_fields = ('id', 'email', )
+        sparse_fields = ('id', 'email', 'is_active', 'is_verified', 'date_joined', 'last_updated', 'role', )
+        expandable = {'role': ('name', )}
+
+    def validate_email(self, value):
+        queryset = User.objects.all()
+        if self.instance is not None:
+            queryset = queryset.exclude(pk=self.instance.pk)
+
+        if bloom.might_exist(value) and shards.locate(queryset, email__lower=value.lower()).exists():
+            raise ValidationError('user with this email address already exists.')
+
+        return value
 
     def create(self, validated_data):
         password = validated_data.pop('password', None)
@@ -17,3 +88,43 @@ class UserSerializer(serializers.ModelSerializer):
         instance.save()
 
         return instance
+
+
+class UserRowSerializer(serializers.BaseSerializer):
+    """
+    Read-only fast path for list responses. Represents named rows from
+    ``values_list(*UserRowSerializer.columns(fields), named=True)`` in
+    UserSerializer's output shape, without building model instances or running
+    per-field to_representation. UUIDs are left for FastJSONRenderer to encode.
+    """
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None) or UserSerializer.Meta.default_fields
+        super().__init__(*args, **kwargs)
+
+        self.expand_role = 'role' in fields
+        self.names = tuple(name for name in fields if name != 'role')
+        self.getter = operator.attrgetter(*self.names) if len(self.names) > 1 else None
+
+    @staticmethod
+    def columns(fields=None):
+        """Columns to select for ``fields``, plus date_joined and id for the pagination cursor."""
+        fields = fields or UserSerializer.Meta.default_fields
+        columns = [name for name in fields if name != 'role']
+
+        if 'role' in fields:
+            # values_list() joins accounts_role in the same query, like select_related.
+            columns += ['role', 'role__name']
+
+        return list(dict.fromkeys(columns + ['date_joined', 'id']))
+
+    def to_representation(self, row):
+        if self.getter is not None:
+            data = dict(zip(self.names, self.getter(row)))
+        else:
+            data = {name: getattr(row, name) for name in self.names}
+
+        if self.expand_role:
+            data['role'] = {'id': row.role, 'name': row.role__name} if row.role is not None else None
+
+        return data
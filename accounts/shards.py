@@ -0,0 +1,257 @@
+"""
+Hash-sharded storage for users and their tokens, configured by DATABASE_SHARDS.
+
+A user lives on the shard that owns its email's bucket: a stable hash of the
+lower-cased email picks one of SHARD_BUCKETS buckets and jump consistent
+hashing maps buckets onto shards, so appending a shard only moves the buckets
+the new shard takes over (see the rebalance_shards command). New user and
+token ids carry the bucket in their last byte, so lookups by id route
+directly as well. Anything that cannot be routed (ids minted before sharding,
+a changed email not yet rebalanced) falls back to querying every other shard
+in parallel.
+
+With a single shard, the default, every helper here is a pass-through and
+the usual routers decide.
+
+Each shard carries the full schema. User and Token rows are partitioned, and
+a user's group and permission rows follow the user. Role rows are written to
+the default database and mirrored to every shard.
+"""
+import concurrent.futures
+import hashlib
+import os
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.http import Http404
+
+SHARD_BUCKETS = 256
+
+SHARDED_MODELS = frozenset((
+    'accounts.user',
+    'accounts.token',
+    'accounts.usertombstone',
+    'accounts.user_groups',
+    'accounts.user_user_permissions',
+))
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def aliases():
+    return settings.DATABASE_SHARDS
+
+
+def enabled():
+    return len(settings.DATABASE_SHARDS) > 1
+
+
+def bucket_for_email(email):
+    return hashlib.sha1((email or '').strip().lower().encode()).digest()[0] % SHARD_BUCKETS
+
+
+def _jump(key, buckets):
+    """Jump consistent hash (Lamping & Veach) of ``key`` onto ``buckets`` slots."""
+    b, j = -1, 0
+
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * (1 << 31) / ((key >> 33) + 1))
+
+    return b
+
+
+def shard_for_bucket(bucket):
+    return settings.DATABASE_SHARDS[_jump(bucket, len(settings.DATABASE_SHARDS))]
+
+
+def tag(value, bucket):
+    """Return the UUID ``value`` with ``bucket`` stored in its last byte."""
+    return uuid.UUID(bytes=value.bytes[:15] + bytes((bucket,)))
+
+
+def bucket_for_id(value):
+    if not isinstance(value, uuid.UUID):
+        value = uuid.UUID(str(value))
+
+    return value.bytes[15]
+
+
+def db_for_email(email):
+    """Shard for ``email``, or None to leave it to the routers when sharding is off."""
+    if not enabled():
+        return None
+
+    return shard_for_bucket(bucket_for_email(email))
+
+
+def db_for_id(value):
+    if not enabled():
+        return None
+
+    try:
+        return shard_for_bucket(bucket_for_id(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _candidate(model, lookup):
+    if model._meta.label_lower == 'accounts.user':
+        for name in ('email', 'email__lower'):
+            if name in lookup:
+                return db_for_email(lookup[name])
+
+    for name in ('pk', 'id'):
+        if name in lookup:
+            return db_for_id(lookup[name])
+
+    return None
+
+
+def _get_executor():
+    """Thread pool for fan-out queries, created per pid so forked workers get their own."""
+    global _executor, _executor_pid
+
+    if _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor_pid != os.getpid():
+                _executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(settings.DATABASE_SHARDS))
+                _executor_pid = os.getpid()
+
+    return _executor
+
+
+def _call(fn, alias):
+    try:
+        return fn(alias)
+    finally:
+        # Pool threads keep their own connections; honour CONN_MAX_AGE like a request would.
+        connections[alias].close_if_unusable_or_obsolete()
+
+
+def fan_out(fn, exclude=None):
+    """
+    Call ``fn(alias)`` for every shard except ``exclude``, in parallel, and
+    return {alias: result}. With sharding off ``fn`` runs once, inline, with
+    None as the alias so the usual routers pick the database.
+    """
+    if not enabled():
+        return {None: fn(None)}
+
+    targets = [alias for alias in settings.DATABASE_SHARDS if alias != exclude]
+    futures = [_get_executor().submit(_call, fn, alias) for alias in targets]
+
+    return {alias: future.result() for alias, future in zip(targets, futures)}
+
+
+def get(queryset, **lookup):
+    """
+    ``queryset.get(**lookup)`` on the shard the lookup routes to, falling back
+    to the other shards when it misses there.
+    """
+    if not enabled():
+        return queryset.get(**lookup)
+
+    candidate = _candidate(queryset.model, lookup)
+
+    if candidate is not None:
+        try:
+            return queryset.using(candidate).get(**lookup)
+        except queryset.model.DoesNotExist:
+            pass
+
+    results = fan_out(lambda alias: queryset.using(alias).filter(**lookup).first(), exclude=candidate)
+
+    for obj in results.values():
+        if obj is not None:
+            return obj
+
+    raise queryset.model.DoesNotExist(f'{queryset.model._meta.object_name} matching query does not exist.')
+
+
+def get_object_or_404(queryset, **lookup):
+    """Like rest_framework.generics.get_object_or_404, routed through get()."""
+    try:
+        return get(queryset, **lookup)
+    except (queryset.model.DoesNotExist, TypeError, ValueError, ValidationError):
+        raise Http404
+
+
+def locate(queryset, **lookup):
+    """
+    ``queryset.filter(**lookup)`` bound to the shard that holds a match, for
+    callers that go on to update() or exists(). With sharding off nothing is
+    queried here.
+    """
+    queryset = queryset.filter(**lookup)
+
+    if not enabled():
+        return queryset
+
+    candidate = _candidate(queryset.model, lookup)
+
+    if candidate is not None and queryset.using(candidate).exists():
+        return queryset.using(candidate)
+
+    for alias, found in fan_out(lambda alias: queryset.using(alias).exists(), exclude=candidate).items():
+        if found:
+            return queryset.using(alias)
+
+    return queryset.using(candidate or DEFAULT_DB_ALIAS)
+
+
+class ShardRouter(object):
+    """
+    Sends User, Token and user M2M rows to their shard: the database an
+    instance was loaded from, or for new rows the shard of the user's email.
+    Queries with nothing to route on are left to the next router; use the
+    helpers above for those.
+    """
+
+    def _db_for_instance(self, instance):
+        if instance is None:
+            return None
+
+        if instance._state.db in settings.DATABASE_SHARDS:
+            return instance._state.db
+
+        label = instance._meta.label_lower
+
+        if label == 'accounts.user':
+            return db_for_email(instance.email)
+
+        if label == 'accounts.token' and instance.user_id is not None:
+            return self._db_for_instance(instance.user)
+
+        return None
+
+    def db_for_read(self, model, **hints):
+        if not enabled() or model._meta.label_lower not in SHARDED_MODELS:
+            return None
+
+        return self._db_for_instance(hints.get('instance'))
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if not enabled():
+            return None
+
+        labels = {obj1._meta.label_lower, obj2._meta.label_lower}
+        if labels <= SHARDED_MODELS:
+            return obj1._state.db == obj2._state.db
+
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Every shard carries the full schema.
+        if db in settings.DATABASE_SHARDS:
+            return True
+
+        return None
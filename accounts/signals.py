@@ -0,0 +1,112 @@
+from django.contrib.auth.models import Group, Permission
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from accounts import authentication, bloom, permission_cache, response_cache, shards
+from accounts.models import Role, User, UserTombstone
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_auth_cache(sender, instance, **kwargs):
+    """
+    Evict the user's cached auth state right away, and again once the
+    transaction commits so a concurrent request cannot re-cache the old row.
+    QuerySet.update() bypasses this, so call authentication.invalidate there.
+    """
+    authentication.invalidate(instance.id, instance.email)
+    transaction.on_commit(lambda: authentication.invalidate(instance.id, instance.email))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_response_cache(sender, instance, **kwargs):
+    # Entries are keyed by ETag, so this only reclaims memory; stale bodies are never served.
+    response_cache.invalidate(instance.id)
+
+
+@receiver(post_save, sender=User)
+def add_to_email_filter(sender, instance, created, update_fields, **kwargs):
+    """
+    Add the email to the filter now and again on commit, so a rebuild reading
+    the table concurrently cannot miss it.
+    """
+    if created or update_fields is None or 'email' in update_fields:
+        bloom.add(instance.email)
+        transaction.on_commit(lambda: bloom.add(instance.email))
+
+
+@receiver(post_delete, sender=User)
+def record_tombstone(sender, instance, using, **kwargs):
+    """Leave a tombstone on the user's database so the changes feed reports the delete."""
+    UserTombstone.objects.using(using).update_or_create(id=instance.id, defaults={'deleted_at': timezone.now()})
+
+
+@receiver(post_save, sender=Role)
+def mirror_role(sender, instance, using, **kwargs):
+    """Copy Role rows from the default database to every shard, so users there can reference them."""
+    if using != DEFAULT_DB_ALIAS:
+        return
+
+    for alias in shards.aliases():
+        if alias != using:
+            Role.objects.using(alias).update_or_create(id=instance.id, defaults={'name': instance.name})
+
+
+@receiver(post_delete, sender=Role)
+def unmirror_role(sender, instance, using, **kwargs):
+    if using != DEFAULT_DB_ALIAS:
+        return
+
+    for alias in shards.aliases():
+        if alias != using:
+            Role.objects.using(alias).filter(id=instance.id).delete()
+
+
+@receiver(post_save, sender=Role)
+@receiver(post_delete, sender=Role)
+def invalidate_role_cache(sender, **kwargs):
+    permission_cache.invalidate_roles()
+    transaction.on_commit(permission_cache.invalidate_roles)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_permission_cache(sender, instance, **kwargs):
+    # As with the auth cache, again on commit so a concurrent check cannot re-cache the old rows.
+    permission_cache.invalidate_user(instance.id)
+    transaction.on_commit(lambda: permission_cache.invalidate_user(instance.id))
+
+
+@receiver(m2m_changed, sender=User.groups.through)
+@receiver(m2m_changed, sender=User.user_permissions.through)
+def invalidate_user_permissions(sender, instance, action, reverse, pk_set, **kwargs):
+    """A user's groups or permissions changed, or a group's or permission's users did."""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if not reverse:
+        permission_cache.invalidate_user(instance.pk)
+        transaction.on_commit(lambda: permission_cache.invalidate_user(instance.pk))
+    elif pk_set:
+        permission_cache.invalidate_user(*pk_set)
+        transaction.on_commit(lambda: permission_cache.invalidate_user(*pk_set))
+    else:
+        permission_cache.invalidate_all()
+        transaction.on_commit(permission_cache.invalidate_all)
+
+
+@receiver(m2m_changed, sender=Group.permissions.through)
+def invalidate_group_permissions(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        permission_cache.invalidate_all()
+        transaction.on_commit(permission_cache.invalidate_all)
+
+
+@receiver(post_delete, sender=Group)
+@receiver(post_delete, sender=Permission)
+def invalidate_all_permissions(sender, **kwargs):
+    permission_cache.invalidate_all()
+    transaction.on_commit(permission_cache.invalidate_all)
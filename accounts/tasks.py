@@ -1,9 +1,139 @@
+import datetime
+import time
+
+import redis
+from django.conf import settings
+from django.template.loader import render_to_string
+from django.utils import timezone
+
 from starter.celery import app
 from celery.utils.log import get_task_logger
 
+from accounts import mail, metrics, publisher, shards, tokens
+from accounts.cache import get_redis
+from accounts.constants import MESSAGE_SUBJECTS, MESSAGE_TOKEN_TYPES
+from accounts.models import Token, User, UserTombstone
+
 logger = get_task_logger(__name__)
 
 
+def compose(command, user):
+    """Issue a token for ``user`` and render the ``command`` email around it."""
+    token = tokens.get_backend().issue(user, MESSAGE_TOKEN_TYPES[command])
+    body = render_to_string(f'accounts/email/{command}.txt', {
+        'link': settings.ACCOUNT_LINKS[command].format(token=token),
+        'hours': settings.ACCOUNT_TOKEN_HOURS,
+    })
+
+    return {'to': [user.email], 'subject': MESSAGE_SUBJECTS[command], 'body': body, 'command': command}
+
+
+def _enqueue(payloads):
+    if payloads and mail.enqueue(*payloads) >= settings.MAIL_BATCH_SIZE:
+        drain_outbox.delay()
+
+
+def _dedup_key(command, recipient):
+    return f'accounts:message:dedup:{command}:{recipient.lower()}'
+
+
+def claim_message(command, recipient):
+    """
+    Atomically claim the right to send ``command`` to ``recipient`` for the
+    next MESSAGE_DEDUP_SECONDS. Returns False, without touching the broker,
+    when an identical message was already enqueued inside that window.
+    """
+    try:
+        claimed = get_redis().set(_dedup_key(command, recipient), 1, nx=True, ex=settings.MESSAGE_DEDUP_SECONDS)
+    except redis.RedisError:
+        logger.warning('Message dedup unavailable, sending %s to %s', command, recipient, exc_info=True)
+        claimed = True
+
+    if not claimed:
+        metrics.incr('messages.suppressed')
+        metrics.incr(f'messages.suppressed.{command}')
+        return False
+
+    return True
+
+
+def enqueue_message(command, recipient):
+    """Publish a message task unless a duplicate was enqueued recently."""
+    if not claim_message(command, recipient):
+        return False
+
+    publisher.publish(message, command, recipient=recipient)
+    metrics.incr('messages.enqueued')
+    return True
+
+
+@app.task()
+def message(command, recipient=None, **kwargs):
+    user = shards.locate(User.objects, email__lower=(recipient or '').lower()).first()
+
+    if user is None:
+        logger.warning('Dropping %s message for unknown recipient %s', command, recipient)
+        return
+
+    _enqueue([compose(command, user)])
+
+
+@app.task()
+def message_batch(command, recipients, **kwargs):
+    emails = [recipient.lower() for recipient in recipients]
+    found = shards.fan_out(lambda alias: list(User.objects.using(alias).filter(email__lower__in=emails)))
+
+    _enqueue([compose(command, user) for users in found.values() for user in users])
+
+
+@app.task()
+def drain_outbox(batch_size=None):
+    """Send buffered messages; runs on a MAIL_FLUSH_INTERVAL_MS beat and when a full batch is queued."""
+    return mail.drain(batch_size)
+
+
+@app.task()
+def purge_expired_tokens(batch_size=None, pause=None):
+    """
+    Delete expired tokens a bounded batch at a time. Each batch is a single
+    DELETE of the oldest rows found through accounts_token_expires_idx, and we
+    sleep between batches so the purge never holds locks for long. Shards
+    are purged one after another.
+    """
+    batch_size = batch_size or settings.TOKEN_PURGE_BATCH_SIZE
+    pause = settings.TOKEN_PURGE_PAUSE if pause is None else pause
+    cutoff = timezone.now()
+    started = time.perf_counter()
+    purged = 0
+
+    for alias in shards.aliases():
+        while True:
+            batch = Token.objects.using(alias).filter(expires__lt=cutoff).order_by('expires').values('pk')[:batch_size]
+            deleted, _ = Token.objects.using(alias).filter(pk__in=batch).delete()
+            purged += deleted
+
+            if deleted < batch_size:
+                break
+
+            time.sleep(pause)
+
+    elapsed = time.perf_counter() - started
+
+    metrics.incr('tokens.purged', purged)
+    metrics.timing('tokens.purge', elapsed * 1000)
+    logger.info('Purged %d expired tokens in %.2fs', purged, elapsed)
+
+    return {'purged': purged, 'seconds': round(elapsed, 3)}
+
+
 @app.task()
-def message(command, **kwargs):
-    pass
+def purge_tombstones():
+    """Drop tombstones older than USER_TOMBSTONE_RETENTION_DAYS, the changes feed's horizon."""
+    cutoff = timezone.now() - datetime.timedelta(days=settings.USER_TOMBSTONE_RETENTION_DAYS)
+    purged = sum(UserTombstone.objects.using(alias).filter(deleted_at__lt=cutoff).delete()[0]
+                 for alias in shards.aliases())
+
+    metrics.incr('tombstones.purged', purged)
+    logger.info('Purged %d user tombstones', purged)
+
+    return {'purged': purged}
@@ -1,15 +1,33 @@
+import asyncio
 import datetime
+import gzip
 import json
+import threading
+import time
+from unittest import mock
 
-from django.db import connection
-from django.test import Client
+from django.contrib.auth.models import Group, Permission
+from django.core import mail as outbox
+from django.core.mail.backends.base import BaseEmailBackend
+from django.db import IntegrityError, connection, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 from rest_framework import status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.request import Request
+from rest_framework_jwt.settings import api_settings
 
+from accounts import (authentication, bloom, db, export, hashing, importer, mail, metrics, publisher, shards, tasks,
+                      throttling, tokens)
+from accounts.cache import get_redis
 from accounts.models import User, UserManager, Role, Token
 
 from rest_framework.test import APITestCase, APIRequestFactory, force_authenticate
 
+from accounts.serializers import UserSerializer
 from accounts.views import UserViewSet
+from starter import routers
 
 
 class UserModelTests(APITestCase):
@@ -29,6 +47,15 @@ class UserModelTests(APITestCase):
         with self.assertRaises(ValueError):
             User.objects.create_user(email='none@reelio.com', password='12345')
 
+    def test_emails_are_unique_regardless_of_case(self):
+        User.objects.create_user(email='none@reelio.com', password='12345')
+
+        with self.assertRaises(ValueError):
+            User.objects.create_user(email='None@Reelio.com', password='12345')
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            User(email='NONE@reelio.com', password='12345').save()
+
     def test_can_create_superuser_with_email_and_password(self):
         user = User.objects.create_superuser(email='admin@reelio.com', password='12345')
         user.save()
@@ -49,6 +76,14 @@ class UserModelTests(APITestCase):
 
         self.assertEquals(user.get_short_name(), 'admin@reelio.com')
 
+    def test_user_ids_are_time_ordered(self):
+        first = User.objects.create_user(email='first@reelio.com', password='12345')
+        time.sleep(0.002)
+        second = User.objects.create_user(email='second@reelio.com', password='12345')
+
+        self.assertLess(first.id, second.id)
+        self.assertLess(Role.objects.create(name='first').id, Role.objects.create(name='second').id)
+
 
 class RoleModelTests(APITestCase):
     def test_role_can_save(self):
@@ -59,12 +94,591 @@ class RoleModelTests(APITestCase):
         self.assertEquals(str(role), 'manager')
 
 
+class AuthenticationCacheTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='cached@reelio.com', password='12345')
+        authentication.local_cache.clear()
+
+    def authenticate(self):
+        token = api_settings.JWT_ENCODE_HANDLER(api_settings.JWT_PAYLOAD_HANDLER(self.user))
+        request = Request(APIRequestFactory().get('/v1/user/', HTTP_AUTHORIZATION=f'JWT {token}'))
+
+        return authentication.CachedJSONWebTokenAuthentication().authenticate(request)
+
+    def test_warm_authentication_makes_no_queries(self):
+        self.authenticate()
+
+        with self.assertNumQueries(0):
+            user, _ = self.authenticate()
+
+        self.assertEquals(user.pk, self.user.pk)
+        self.assertTrue(user.is_active)
+
+    def test_deactivation_takes_effect_immediately(self):
+        self.authenticate()
+
+        self.user.is_active = False
+        self.user.save()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_password_change_revokes_existing_tokens(self):
+        token = api_settings.JWT_ENCODE_HANDLER(api_settings.JWT_PAYLOAD_HANDLER(self.user))
+
+        self.user.set_password('54321')
+        self.user.save()
+
+        request = Request(APIRequestFactory().get('/v1/user/', HTTP_AUTHORIZATION=f'JWT {token}'))
+        with self.assertRaises(AuthenticationFailed):
+            authentication.CachedJSONWebTokenAuthentication().authenticate(request)
+
+
+class PermissionCacheTests(APITestCase):
+    def setUp(self):
+        self.role = Role.objects.create(name='support')
+        self.user = User.objects.create_user(email='perms@reelio.com', password='12345', role=self.role)
+        self.user.user_permissions.add(Permission.objects.get(codename='change_user'))
+        self.group = Group.objects.create(name='auditors')
+        self.user.groups.add(self.group)
+        authentication.local_cache.clear()
+
+    def test_warm_permission_checks_make_no_queries(self):
+        self.assertTrue(User.objects.get(pk=self.user.pk).has_perm('accounts.change_user'))
+
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(user.has_perm('accounts.change_user'))
+            self.assertFalse(user.has_perm('accounts.delete_user'))
+            self.assertTrue(user.has_module_perms('accounts'))
+
+        self.group.permissions.add(Permission.objects.get(codename='delete_user'))
+
+        self.assertTrue(User.objects.get(pk=self.user.pk).has_perm('accounts.delete_user'))
+
+    def test_authenticated_users_get_their_role_without_a_query(self):
+        token = api_settings.JWT_ENCODE_HANDLER(api_settings.JWT_PAYLOAD_HANDLER(self.user))
+
+        def authenticate():
+            request = Request(APIRequestFactory().get('/v1/user/', HTTP_AUTHORIZATION=f'JWT {token}'))
+            return authentication.CachedJSONWebTokenAuthentication().authenticate(request)[0]
+
+        authenticate()
+        with self.assertNumQueries(0):
+            self.assertEquals(authenticate().role.name, 'support')
+
+        self.role.name = 'escalations'
+        self.role.save()
+
+        self.assertEquals(authenticate().role.name, 'escalations')
+
+
+class HashingExecutorTests(APITestCase):
+    def test_pool_hashes_and_verifies_passwords(self):
+        user = User.objects.create_user(email='hashed@reelio.com', password='12345')
+
+        self.assertTrue(user.check_password('12345'))
+        self.assertFalse(user.check_password('54321'))
+
+    def test_full_queue_fails_fast_with_retry_after(self):
+        executor = hashing.ProcessPoolHashingExecutor(workers=1, max_queue=0, retry_after=3)
+
+        with self.assertRaises(hashing.HashingUnavailable) as raised:
+            executor.run(hashing.hashers.make_password, '12345')
+
+        self.assertEquals(raised.exception.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEquals(raised.exception.wait, 3)
+
+    def test_timeouts_fail_with_retry_after(self):
+        executor = hashing.ProcessPoolHashingExecutor(workers=1, timeout=0.01, retry_after=3)
+
+        with self.assertRaises(hashing.HashingUnavailable) as raised:
+            executor.run(time.sleep, 1)
+        self.assertEquals(raised.exception.wait, 3)
+
+        with self.assertRaises(hashing.HashingUnavailable):
+            executor.map(time.sleep, [1, 1])
+
+    def test_batches_take_a_slot_per_password(self):
+        executor = hashing.ProcessPoolHashingExecutor(workers=2, max_queue=3)
+        depths = []
+
+        with mock.patch.object(hashing.metrics, 'gauge', lambda name, value: depths.append(value)):
+            encoded = executor.map(hashing.hashers.make_password, ['1', '2', '3', '4', '5'])
+
+        self.assertEquals(len(encoded), 5)
+        self.assertTrue(hashing.hashers.check_password('5', encoded[4]))
+        self.assertEquals(max(depths), 2)
+        self.assertEquals(depths[-1], 0)
+
+
+class TokenPurgeTests(APITestCase):
+    def test_purge_removes_only_expired_tokens(self):
+        user = User.objects.create_user(email='purge@reelio.com', password='12345')
+
+        for _ in range(5):
+            Token(user=user, type='VERIFY').save(hours=-1)
+
+        live = Token(user=user, type='RESET')
+        live.save()
+
+        result = tasks.purge_expired_tokens(batch_size=2, pause=0)
+
+        self.assertEquals(result['purged'], 5)
+        self.assertEquals(list(Token.objects.values_list('pk', flat=True)), [live.pk])
+
+
+class StubConnection(object):
+    alias = 'stub'
+
+    def __init__(self, usable, idle):
+        self.connection = object()
+        self.usable = usable
+        self.released_at = time.monotonic() - idle
+
+    def is_usable(self):
+        return self.usable
+
+    def close(self):
+        self.connection = None
+
+
+class ConnectionHealthTests(APITestCase):
+    def test_stale_idle_connection_is_dropped_before_reuse(self):
+        stale = StubConnection(usable=False, idle=3600)
+        recent = StubConnection(usable=False, idle=0)
+
+        with mock.patch.object(db.connections, 'all', return_value=[stale, recent]):
+            db.check_connections()
+
+        self.assertIsNone(stale.connection)
+        # Recently released connections skip the ping entirely.
+        self.assertIsNotNone(recent.connection)
+
+
+class ReplicaRouterTests(APITestCase):
+    def setUp(self):
+        routers.reset()
+        self.router = routers.ReplicaRouter(weights={'replica_a': 2, 'replica_b': 1})
+        self.available = {'replica_a': True, 'replica_b': True}
+        self.router._is_available = lambda alias: self.available[alias]
+
+    def reads(self, count):
+        return [self.router.db_for_read(User) for _ in range(count)]
+
+    def test_reads_outside_replica_block_use_primary(self):
+        self.assertEquals(self.reads(2), ['default', 'default'])
+
+    def test_replica_reads_are_weighted_round_robin(self):
+        with routers.read_from_replica():
+            self.assertEquals(sorted(self.reads(6)), ['replica_a'] * 4 + ['replica_b'] * 2)
+
+    def test_reads_are_pinned_to_primary_after_a_write(self):
+        with routers.read_from_replica():
+            self.router.db_for_write(User)
+            self.assertEquals(self.reads(3), ['default'] * 3)
+
+    def test_unreachable_replicas_fall_back(self):
+        self.available['replica_a'] = False
+
+        with routers.read_from_replica():
+            self.assertEquals(self.reads(3), ['replica_b'] * 3)
+
+            self.available['replica_b'] = False
+            self.assertEquals(self.reads(2), ['default'] * 2)
+
+    def test_authentication_reads_the_primary_on_replica_views(self):
+        user = User.objects.create_user(email='replica@reelio.com', password='12345')
+        token = api_settings.JWT_ENCODE_HANDLER(api_settings.JWT_PAYLOAD_HANDLER(user))
+        authentication.local_cache.clear()
+        during = []
+
+        get_auth_state = authentication.get_auth_state
+
+        def record(email):
+            during.append(routers._state.replica)
+            return get_auth_state(email)
+
+        request = APIRequestFactory().get('/v1/user/', HTTP_AUTHORIZATION=f'JWT {token}')
+        with mock.patch.object(authentication, 'get_auth_state', record):
+            response = UserViewSet.as_view({'get': 'list'})(request)
+
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals(during, [False])
+
+
+SHARDS = ['default', 'shard_1', 'shard_2']
+
+
+class ShardRoutingTests(APITestCase):
+    def test_new_user_ids_route_to_the_email_shard(self):
+        user = User.objects.create_user(email='sharded@reelio.com', password='12345')
+
+        self.assertEquals(shards.bucket_for_id(user.pk), shards.bucket_for_email('Sharded@Reelio.com'))
+        self.assertEquals(user.pk.version, 7)
+
+        with override_settings(DATABASE_SHARDS=SHARDS):
+            self.assertEquals(shards.db_for_id(user.pk), shards.db_for_email(user.email))
+
+    @override_settings(DATABASE_SHARDS=SHARDS)
+    def test_adding_a_shard_only_moves_buckets_onto_it(self):
+        before = {bucket: shards.shard_for_bucket(bucket) for bucket in range(shards.SHARD_BUCKETS)}
+
+        with override_settings(DATABASE_SHARDS=SHARDS + ['shard_3']):
+            after = {bucket: shards.shard_for_bucket(bucket) for bucket in range(shards.SHARD_BUCKETS)}
+
+        moved = {after[bucket] for bucket in before if before[bucket] != after[bucket]}
+        self.assertEquals(moved, {'shard_3'})
+
+    @override_settings(DATABASE_SHARDS=SHARDS)
+    def test_router_writes_follow_the_instance(self):
+        router = shards.ShardRouter()
+        user = User(email='router@reelio.com')
+
+        self.assertEquals(router.db_for_write(User, instance=user), shards.db_for_email(user.email))
+        self.assertIsNone(router.db_for_write(Role, instance=user))
+
+        user._state.db = 'shard_2'
+        self.assertEquals(router.db_for_read(Token, instance=user), 'shard_2')
+
+
+class TaskRoutingTests(APITestCase):
+    def test_tasks_are_routed_to_their_queues(self):
+        router = tasks.app.amqp.router
+
+        self.assertEquals(router.route({}, 'accounts.tasks.message')['queue'].name, 'real_time')
+        self.assertEquals(router.route({}, 'accounts.tasks.message_batch')['queue'].name, 'bulk')
+        self.assertEquals(router.route({}, 'accounts.tasks.purge_expired_tokens')['queue'].name, 'maintenance')
+
+    def test_fire_and_forget_tasks_ignore_results(self):
+        self.assertTrue(tasks.message.ignore_result)
+        self.assertTrue(tasks.purge_expired_tokens.ignore_result)
+
+
+class RecordingTask(object):
+    name = 'recording'
+
+    def __init__(self):
+        self.calls = []
+
+    def apply_async(self, args, kwargs):
+        self.calls.append((threading.current_thread().name, args, kwargs))
+
+
+class ServerModeTests(APITestCase):
+    @override_settings(CELERY_PUBLISH_IN_BACKGROUND=True)
+    def test_publishes_happen_off_the_request_thread(self):
+        task = RecordingTask()
+
+        publisher.publish(task, 'verify', recipient='none@reelio.com')
+        publisher.flush()
+
+        self.assertEquals(task.calls, [('celery-publisher', ('verify',), {'recipient': 'none@reelio.com'})])
+
+    def test_asgi_application_serves_requests(self):
+        from asgiref.testing import ApplicationCommunicator
+        from starter.asgi import application
+
+        communicator = ApplicationCommunicator(application, {
+            'type': 'http', 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+            'path': '/v1/user/', 'query_string': b'', 'headers': [(b'host', b'testserver')],
+        })
+
+        async def get():
+            await communicator.send_input({'type': 'http.request', 'body': b''})
+            return await communicator.receive_output(timeout=5)
+
+        start = asyncio.get_event_loop().run_until_complete(get())
+
+        self.assertEquals(start['status'], status.HTTP_401_UNAUTHORIZED)
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise ConnectionError('SMTP unavailable')
+
+
+class MailPipelineTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='mail@reelio.com', password='12345')
+        get_redis().delete(mail.OUTBOX_KEY, mail.PROCESSING_KEY, mail.DEAD_LETTER_KEY, mail.DRAIN_LOCK_KEY)
+
+    def test_messages_are_buffered_then_sent_in_a_batch(self):
+        tasks.message('verify', recipient='mail@reelio.com')
+        tasks.message_batch('reset', recipients=['mail@reelio.com'])
+
+        self.assertEquals(len(outbox.outbox), 0)
+
+        result = tasks.drain_outbox()
+
+        self.assertEquals(result, {'sent': 2, 'failed': 0, 'batches': 1})
+        self.assertEquals([m.subject for m in outbox.outbox], ['Confirm your email address', 'Reset your password'])
+        self.assertEquals(Token.objects.filter(user=self.user).count(), 2)
+
+    @override_settings(EMAIL_BACKEND='accounts.tests.FailingEmailBackend')
+    def test_failed_messages_go_to_dead_letter_list(self):
+        tasks.message('verify', recipient='mail@reelio.com')
+
+        result = tasks.drain_outbox()
+
+        self.assertEquals(result['failed'], 1)
+        dead = json.loads(get_redis().lindex(mail.DEAD_LETTER_KEY, 0))
+        self.assertEquals(dead['to'], ['mail@reelio.com'])
+        self.assertIn('SMTP unavailable', dead['error'])
+
+    def test_messages_claimed_by_a_crashed_drainer_are_sent(self):
+        mail.enqueue(*[{'to': ['mail@reelio.com'], 'subject': f'Message {i}', 'body': ''} for i in range(3)])
+        # A drainer that died after claiming the first two.
+        mail._claim_batch(get_redis(), 2)
+
+        result = tasks.drain_outbox()
+
+        self.assertEquals(result['sent'], 3)
+        self.assertEquals([m.subject for m in outbox.outbox], ['Message 0', 'Message 1', 'Message 2'])
+        self.assertEquals(get_redis().llen(mail.PROCESSING_KEY), 0)
+
+    def drain_on_clock(self, **patches):
+        """Drain while every message takes 25s on the drainer's clock, past the heartbeat of a 60s lock."""
+        clock = [0]
+        send = mail._send
+
+        def slow_send(raw):
+            clock[0] += 25
+            return send(raw)
+
+        fake_time = mock.Mock(wraps=time)
+        fake_time.monotonic.side_effect = lambda: clock[0]
+
+        with override_settings(MAIL_DRAIN_LOCK_MS=60000), mock.patch.object(mail, 'time', fake_time), \
+                mock.patch.object(mail, '_send', slow_send), mock.patch.multiple(mail, **patches):
+            return tasks.drain_outbox()
+
+    def test_drain_lock_is_extended_while_sending(self):
+        mail.enqueue(*[{'to': ['mail@reelio.com'], 'subject': f'Message {i}', 'body': ''} for i in range(5)])
+        extend = mock.Mock(wraps=mail._extend_lock)
+
+        result = self.drain_on_clock(_extend_lock=extend)
+
+        self.assertEquals(result['sent'], 5)
+        # Due before every message but the first, always for the lock this drainer took.
+        self.assertEquals(extend.call_count, 4)
+        self.assertEquals(len({lock for (client, lock), kwargs in extend.call_args_list}), 1)
+
+    def test_drain_stops_when_the_lock_is_lost(self):
+        mail.enqueue(*[{'to': ['mail@reelio.com'], 'subject': f'Message {i}', 'body': ''} for i in range(5)])
+
+        result = self.drain_on_clock(_extend_lock=mock.Mock(return_value=False))
+
+        self.assertEquals(result, {'sent': 0, 'failed': 0, 'batches': 0})
+        self.assertEquals([m.subject for m in outbox.outbox], ['Message 0'])
+        # Left for whoever holds the lock now.
+        self.assertEquals(get_redis().llen(mail.PROCESSING_KEY), 5)
+
+
+class MessageDedupTests(APITestCase):
+    def setUp(self):
+        User.objects.create_user(email='dedup@reelio.com', password='12345')
+        get_redis().delete(tasks._dedup_key('reset', 'dedup@reelio.com'))
+        metrics.reset()
+
+    def test_repeated_requests_are_coalesced(self):
+        self.assertTrue(tasks.claim_message('reset', 'dedup@reelio.com'))
+
+        c = Client()
+        for _ in range(3):
+            response = c.post('/v1/request_password_change/', json.dumps({
+                'email': 'dedup@reelio.com'
+            }), content_type='application/json')
+
+            self.assertEquals(response.status_code, status.HTTP_200_OK)
+
+        self.assertEquals(metrics.snapshot()['counters']['messages.suppressed.reset'], 3)
+
+
+@override_settings(PUBLIC_THROTTLE_EMAIL_RATE='2/min')
+class PublicThrottleTests(APITestCase):
+    def setUp(self):
+        User.objects.create_user(email='hot@reelio.com', password='12345')
+        get_redis().delete('accounts:throttle:ip:10.0.0.7', 'accounts:throttle:email:hot@reelio.com')
+        throttling._get_blocked().clear()
+        metrics.reset()
+
+    def test_rejected_requests_never_reach_the_database(self):
+        c = Client(REMOTE_ADDR='10.0.0.7')
+        for _ in range(2):
+            response = c.post('/v1/request_password_change/', {'email': 'hot@reelio.com'})
+            self.assertEquals(response.status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(0):
+            response = c.post('/v1/request_password_change/', {'email': 'Hot@reelio.com'})
+            self.assertEquals(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertTrue(int(response['Retry-After']) > 0)
+
+            response = c.post('/v1/auth/', {'email': 'hot@reelio.com', 'password': '12345'})
+            self.assertEquals(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+        counters = metrics.snapshot()['counters']
+        self.assertEquals(counters['throttle.rejected'], 1)
+        self.assertEquals(counters['throttle.rejected_local'], 1)
+
+        # The client IP still has tokens for other emails.
+        response = c.post('/v1/request_password_change/', {'email': 'cold@reelio.com'})
+        self.assertEquals(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    @override_settings(PUBLIC_THROTTLE_IP_RATE='2/min')
+    def test_rotating_forwarded_for_does_not_reset_the_ip_bucket(self):
+        c = Client(REMOTE_ADDR='10.0.0.7')
+        for number in range(2):
+            response = c.post('/v1/request_password_change/', {'email': f'spray{number}@reelio.com'},
+                              HTTP_X_FORWARDED_FOR=f'203.0.113.{number}')
+            self.assertEquals(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        response = c.post('/v1/request_password_change/', {'email': 'spray2@reelio.com'},
+                          HTTP_X_FORWARDED_FOR='203.0.113.2')
+        self.assertEquals(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+
+class EmailBloomTests(APITestCase):
+    def setUp(self):
+        User.objects.create_user(email='known@reelio.com', password='12345')
+        bloom.rebuild(User.objects.values_list('email', flat=True))
+
+    def tearDown(self):
+        get_redis().delete(bloom._key(), f'{bloom._key()}:ready')
+        bloom._mirror = None
+
+    def test_unknown_emails_skip_the_database(self):
+        with self.assertNumQueries(0):
+            response = Client().post('/v1/request_password_change/', {'email': 'nobody-at-all@reelio.com'})
+
+        self.assertEquals(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertTrue(bloom.might_exist('Known@reelio.com'))
+
+    def test_new_users_are_added_without_a_rebuild(self):
+        self.assertFalse(bloom.might_exist('later@reelio.com'))
+        copy = bloom._get_mirror()['data']
+        stale = bytes(copy)
+
+        User.objects.create_user(email='later@reelio.com', password='12345')
+        # As in another process whose copy predates the user, Redis must still know it.
+        copy[:] = stale
+
+        self.assertTrue(bloom.might_exist('later@reelio.com'))
+        self.assertTrue(bloom._test(copy, bloom.positions('later@reelio.com', *bloom.size())))
+        with self.assertRaises(ValueError):
+            User.objects.create_user(email='later@reelio.com', password='12345')
+
+    def test_copy_is_downloaded_again_only_after_a_rebuild(self):
+        copy = bloom._get_mirror()
+
+        copy['checked'] = 0
+        self.assertIs(bloom._get_mirror()['data'], copy['data'])
+
+        bloom.rebuild(User.objects.values_list('email', flat=True))
+        self.assertIsNot(bloom._get_mirror()['data'], copy['data'])
+
+
+class UserImportTests(APITestCase):
+    def setUp(self):
+        User.objects.create_user(email='exists@reelio.com', password='12345')
+
+    def test_imports_plaintext_and_prehashed_passwords(self):
+        records = enumerate([
+            {'email': 'plain@reelio.com', 'password': '12345'},
+            {'email': 'hashed@reelio.com', 'password_hash': hashing.hashers.make_password('54321')},
+            {'email': 'plain@reelio.com', 'password': '99999'},
+            {'email': 'exists@reelio.com', 'password': '99999'},
+            {'email': 'bad@reelio.com', 'password_hash': 'plaintext'},
+            None,
+            {'email': 5, 'password': '12345'},
+            {'email': 'typed@reelio.com', 'password_hash': 12345},
+        ], 1)
+        rejected = []
+
+        stats = importer.import_users(records, chunk_size=4, invalid=lambda number, errors: rejected.append(number))
+
+        self.assertEquals(stats, {'read': 8, 'imported': 2, 'skipped': 2, 'invalid': 4})
+        self.assertEquals(rejected, [5, 6, 7, 8])
+        self.assertTrue(User.objects.get(email='plain@reelio.com').check_password('12345'))
+        self.assertTrue(User.objects.get(email='hashed@reelio.com').check_password('54321'))
+        self.assertTrue(User.objects.get(email='exists@reelio.com').check_password('12345'))
+
+    def test_update_on_conflict_replaces_existing_passwords(self):
+        records = enumerate([{'email': 'exists@reelio.com', 'password': '99999', 'is_verified': 'true'}], 1)
+
+        stats = importer.import_users(records, on_conflict=importer.UPDATE)
+
+        user = User.objects.get(email='exists@reelio.com')
+        self.assertEquals(stats['imported'], 1)
+        self.assertTrue(user.is_verified)
+        self.assertTrue(user.check_password('99999'))
+
+    def test_update_on_conflict_drops_cached_auth_state(self):
+        authentication.local_cache.clear()
+        self.assertTrue(authentication.get_auth_state('exists@reelio.com')['is_active'])
+        records = enumerate([{'email': 'exists@reelio.com', 'password': '99999', 'is_active': 'false'}], 1)
+
+        importer.import_users(records, on_conflict=importer.UPDATE)
+
+        self.assertFalse(authentication.get_auth_state('exists@reelio.com')['is_active'])
+
+
+@override_settings(ACCOUNT_TOKEN_BACKEND='accounts.tokens.SignedTokenBackend')
+class SignedTokenTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='signed@reelio.com', password='12345')
+
+    def test_verify_token_confirms_user_once(self):
+        token = tokens.get_backend().issue(self.user, 'VERIFY')
+
+        c = Client()
+        response = c.post(f'/v1/confirm/?id={token}')
+
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(User.objects.get(pk=self.user.pk).is_verified)
+
+        response = c.post(f'/v1/confirm/?id={token}')
+
+        self.assertEquals(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_reset_token_changes_password_once(self):
+        token = tokens.get_backend().issue(self.user, 'RESET')
+
+        c = Client()
+        response = c.post(f'/v1/change_password/{token}/', json.dumps({
+            'password': '09876'
+        }), content_type='application/json')
+
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(User.objects.get(pk=self.user.pk).check_password('09876'))
+
+        response = c.post(f'/v1/change_password/{token}/', json.dumps({
+            'password': '11111'
+        }), content_type='application/json')
+
+        self.assertEquals(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_token_type_must_match(self):
+        token = tokens.get_backend().issue(self.user, 'RESET')
+
+        response = Client().post(f'/v1/confirm/?id={token}')
+
+        self.assertEquals(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
 class APITests(APITestCase):
 
     def setUp(self):
         self.user = User.objects.create_user(email='none@reelio.com', password='12345')
         self.user.save()
 
+        # The public endpoints' buckets outlive a run; start every test with full ones.
+        client = get_redis()
+        keys = list(client.scan_iter('accounts:throttle:*'))
+        if keys:
+            client.delete(*keys)
+        throttling._get_blocked().clear()
+
     def tearDown(self):
         pass
 
@@ -100,6 +714,19 @@ class APITests(APITestCase):
         self.assertEquals(response.status_code, status.HTTP_200_OK)
         self.assertTrue('token' in response.data)
 
+    def test_email_lookups_ignore_case(self):
+        c = Client()
+
+        response = c.post('/v1/register/', {'email': 'NONE@reelio.com', 'password': '12345'})
+        self.assertEquals(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue('email' in response.json())
+
+        response = c.post('/v1/auth/', {'email': 'None@Reelio.com', 'password': '12345'})
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+
+        response = c.post('/v1/request_password_change/', {'email': 'NONE@REELIO.COM'})
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+
     def test_authentication_fails_with_bad_password(self):
         c = Client()
         response = c.post('/v1/auth/', {
@@ -124,6 +751,252 @@ class APITests(APITestCase):
 
         self.assertEquals(response.status_code, status.HTTP_404_NOT_FOUND)
 
+    def get_user(self, **headers):
+        request = APIRequestFactory().get(f'/v1/user/{self.user.pk}/', **headers)
+        force_authenticate(request, user=self.user)
+
+        return UserViewSet.as_view({'get': 'retrieve'})(request, pk=str(self.user.pk))
+
+    def test_user_detail_supports_conditional_get(self):
+        etag = self.get_user()['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.get_user(HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.user.is_verified = True
+        self.user.save()
+
+        response = self.get_user(HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertNotEquals(response['ETag'], etag)
+
+    @override_settings(USER_RESPONSE_CACHE=True)
+    def test_user_detail_is_served_from_response_cache(self):
+        first = self.get_user()
+
+        with self.assertNumQueries(1):
+            second = self.get_user()
+
+        self.assertEquals(second.content, first.content)
+        self.assertEquals(json.loads(second.content)['email'], 'none@reelio.com')
+
+    @override_settings(USER_RESPONSE_CACHE=True)
+    def test_user_detail_changes_when_its_role_is_renamed(self):
+        self.user.role = Role.objects.create(name='admin')
+        self.user.save()
+        first = self.get_user(QUERY_STRING='fields=role')
+
+        self.user.role.name = 'owner'
+        self.user.role.save()
+
+        response = self.get_user(QUERY_STRING='fields=role', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals(json.loads(response.content)['role']['name'], 'owner')
+
+    def get_changes(self, since=None, limit=2):
+        request = APIRequestFactory().get('/v1/user/changes/', {'since': since or '', 'limit': limit})
+        force_authenticate(request, user=self.user)
+
+        return UserViewSet.as_view({'get': 'changes'})(request).data
+
+    @override_settings(CHANGES_FEED_LAG_SECONDS=0)
+    def test_changes_feed_pages_through_changed_users(self):
+        for i in range(2):
+            User.objects.create_user(email=f'changed{i}@reelio.com', password='12345')
+
+        first = self.get_changes()
+        second = self.get_changes(first['cursor'])
+
+        self.assertTrue(first['has_more'])
+        self.assertFalse(second['has_more'])
+        self.assertEquals([row['email'] for row in first['results'] + second['results']],
+                          ['none@reelio.com', 'changed0@reelio.com', 'changed1@reelio.com'])
+        self.assertEquals(self.get_changes(second['cursor'])['results'], [])
+
+    @override_settings(CHANGES_FEED_LAG_SECONDS=0)
+    def test_changes_feed_reports_deletes(self):
+        cursor = self.get_changes(limit=10)['cursor']
+
+        user = User.objects.create_user(email='gone@reelio.com', password='12345')
+        user_id = user.id
+        user.delete()
+
+        results = self.get_changes(cursor, limit=10)['results']
+
+        self.assertEquals([(row['type'], row['id']) for row in results], [('deleted', user_id)])
+
+    def test_user_list_is_cursor_paginated(self):
+        factory = APIRequestFactory()
+
+        for i in range(4):
+            User.objects.create_user(email=f'page{i}@reelio.com', password='12345')
+
+        view = UserViewSet.as_view({'get': 'list'})
+        url = '/v1/user/?page_size=2'
+        seen = []
+
+        while url:
+            request = factory.get(url)
+            force_authenticate(request, user=self.user)
+            response = view(request)
+
+            self.assertEquals(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 2)
+            seen.extend(row['id'] for row in response.data['results'])
+            url = response.data['next']
+
+        self.assertEquals(len(seen), 5)
+        self.assertEquals(len(set(seen)), 5)
+
+    def test_user_list_cursor_keeps_users_joined_at_the_same_time(self):
+        factory = APIRequestFactory()
+
+        for i in range(6):
+            User.objects.create_user(email=f'same{i}@reelio.com', password='12345')
+        User.objects.update(date_joined=timezone.now())
+
+        def page(url):
+            request = factory.get(url)
+            force_authenticate(request, user=self.user)
+            response = UserViewSet.as_view({'get': 'list'})(request)
+            self.assertEquals(response.status_code, status.HTTP_200_OK)
+            return response.data
+
+        url, pages = '/v1/user/?page_size=2&fields=email', []
+        while url:
+            data = page(url)
+            pages.append([row['email'] for row in data['results']])
+            url = data['next']
+
+        emails = [email for rows in pages for email in rows]
+        self.assertEquals(len(emails), 7)
+        self.assertEquals(len(set(emails)), 7)
+
+        # And back again from the last page.
+        self.assertEquals([row['email'] for row in page(data['previous'])['results']], pages[-2])
+
+    def test_user_list_merges_pages_from_every_shard(self):
+        for i in range(4):
+            User.objects.create_user(email=f'spread{i}@reelio.com', password='12345')
+
+        def fan_out(fn, exclude=None):
+            # Every other row on each of two shards, as each would return it.
+            rows = fn(None)
+            return {'default': rows[1::2], 'shard_1': rows[::2]}
+
+        url, seen = '/v1/user/?page_size=2', []
+        with mock.patch.object(shards, 'fan_out', fan_out):
+            while url:
+                request = APIRequestFactory().get(url)
+                force_authenticate(request, user=self.user)
+                data = UserViewSet.as_view({'get': 'list'})(request).data
+                seen.extend(row['id'] for row in data['results'])
+                url = data['next']
+
+        self.assertEquals(seen, list(User.objects.order_by('date_joined', 'id').values_list('id', flat=True)))
+
+    def test_user_list_fast_path_matches_model_serializer(self):
+        User.objects.create_user(email='fast@reelio.com', password='12345')
+
+        request = APIRequestFactory().get('/v1/user/')
+        force_authenticate(request, user=self.user)
+        response = UserViewSet.as_view({'get': 'list'})(request)
+        response.render()
+
+        expected = UserSerializer(User.objects.order_by('date_joined', 'id'), many=True).data
+        self.assertEquals(json.loads(response.content)['results'], json.loads(json.dumps(expected, default=str)))
+
+    def test_sparse_fieldsets_prune_output_and_columns(self):
+        request = APIRequestFactory().get('/v1/user/', {'fields': 'id'})
+        force_authenticate(request, user=self.user)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = UserViewSet.as_view({'get': 'list'})(request)
+
+        self.assertEquals(response.data['results'], [{'id': self.user.id}])
+        self.assertNotIn('email', queries.captured_queries[0]['sql'])
+
+        request = APIRequestFactory().get('/v1/user/', {'fields': 'id,password'})
+        force_authenticate(request, user=self.user)
+        self.assertEquals(UserViewSet.as_view({'get': 'list'})(request).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_sparse_fieldsets_expand_role_in_one_query(self):
+        self.user.role = Role.objects.create(name='admin')
+        self.user.save()
+
+        request = APIRequestFactory().get(f'/v1/user/{self.user.pk}/', {'fields': 'email,role'})
+        force_authenticate(request, user=self.user)
+
+        # One query for the ETag validator, one for the user joined with its role.
+        with self.assertNumQueries(2):
+            response = UserViewSet.as_view({'get': 'retrieve'})(request, pk=str(self.user.pk))
+
+        self.assertEquals(response.data, {
+            'email': 'none@reelio.com',
+            'role': {'id': str(self.user.role_id), 'name': 'admin'},
+        })
+
+    def test_batch_lookup_keys_results_by_input(self):
+        other = User.objects.create_user(email='batch@reelio.com', password='12345')
+        unknown = '8fdfe416-c106-4acb-ac02-2fb241f24ae5'
+
+        self.client.force_authenticate(user=self.user)
+        with self.assertNumQueries(2):
+            response = self.client.post('/v1/user/batch/?fields=id', {
+                'ids': [str(other.id), unknown, 'not-a-uuid'],
+                'emails': ['none@reelio.com', 'None@Reelio.com', 'nobody@reelio.com'],
+            }, format='json')
+
+        self.assertEquals(response.status_code, status.HTTP_200_OK)
+        self.assertEquals(response.data['ids'][str(other.id)], {'id': other.id})
+        self.assertEquals(response.data['emails']['none@reelio.com'], {'id': self.user.id})
+        self.assertEquals(response.data['emails']['None@Reelio.com'], {'id': self.user.id})
+        self.assertEquals(response.data['missing'], {'ids': [unknown, 'not-a-uuid'], 'emails': ['nobody@reelio.com']})
+
+        with override_settings(USER_BATCH_MAX_SIZE=2):
+            response = self.client.post('/v1/user/batch/', {'ids': [unknown] * 3}, format='json')
+        self.assertEquals(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_staff_can_stream_a_user_export(self):
+        self.client.force_authenticate(user=self.user)
+        self.assertEquals(self.client.get('/v1/user/export/').status_code, status.HTTP_403_FORBIDDEN)
+
+        admin = User.objects.create_superuser(email='admin@reelio.com', password='12345')
+        self.client.force_authenticate(user=admin)
+
+        response = self.client.get('/v1/user/export/')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEquals(lines[0], ','.join(export.FIELDS))
+        self.assertEquals([line.split(',')[1] for line in lines[1:]], ['none@reelio.com', 'admin@reelio.com'])
+
+        response = self.client.get('/v1/user/export/', {'output': 'jsonl', 'gzip': 'true'})
+        rows = [json.loads(line) for line in gzip.decompress(b''.join(response.streaming_content)).splitlines()]
+        self.assertEquals(response['Content-Type'], 'application/gzip')
+        self.assertEquals([row['email'] for row in rows], ['none@reelio.com', 'admin@reelio.com'])
+
+    def test_can_bulk_register_users(self):
+        admin = User.objects.create_superuser(email='admin@reelio.com', password='12345')
+
+        rows = [
+            {'email': 'bulk1@reelio.com', 'password': '12345'},
+            {'email': 'none@reelio.com', 'password': '12345'},
+            {'email': 'bulk1@reelio.com', 'password': '12345'},
+            {'email': 'not-an-email', 'password': '12345'},
+            {'email': 5, 'password': '12345'},
+            {'email': 'typed@reelio.com', 'password': 12345},
+        ]
+        body = '\n'.join(json.dumps(row) for row in rows)
+
+        self.client.force_authenticate(user=admin)
+        response = self.client.post('/v1/register/bulk/', body, content_type='application/x-ndjson')
+
+        self.assertEquals(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEquals(response.data['created'], 1)
+        self.assertEquals([row['status'] for row in response.data['results']],
+                          ['created', 'exists', 'duplicate', 'invalid', 'invalid', 'invalid'])
+        self.assertTrue(User.objects.get(email='bulk1@reelio.com').check_password('12345'))
+
     def test_can_request_a_password_reset(self):
         user = User.objects.create_user(email='notme@reelio.com', password='12345')
         user.save()
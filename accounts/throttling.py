@@ -0,0 +1,150 @@
+"""
+Rate limiting for the unauthenticated endpoints (register, confirm,
+reset_confirm, request_password_change, change_password and /v1/auth/).
+
+Each request draws a token from a bucket per client IP and, when the body
+names one, a bucket per target email. Both live in Redis and are checked and
+drawn from by one Lua script, so concurrent workers cannot overdraw them and
+a request is only charged when every bucket has a token. A rejection is
+remembered in-process until its bucket refills, and repeats from the same
+key are turned away without a Redis round trip.
+
+Throttles run before the view, and the throttled views do no authentication,
+so a rejected request never reaches the database or the password hasher. If
+Redis is unreachable requests are let through.
+"""
+import logging
+import math
+import time
+
+import redis
+from django.conf import settings
+from rest_framework.throttling import BaseThrottle
+
+from accounts import metrics
+from accounts.cache import LRUCache, get_redis
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {'s': 1, 'sec': 1, 'min': 60, 'h': 3600, 'hour': 3600, 'd': 86400, 'day': 86400}
+
+# KEYS are the buckets, ARGV the time in milliseconds followed by the capacity
+# and refill rate (tokens per millisecond) of each bucket. Returns, per bucket,
+# the milliseconds until it holds a token; nothing is drawn unless all are 0.
+TAKE = """
+local now = tonumber(ARGV[1])
+local levels = {}
+local waits = {}
+local empty = false
+
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2])
+    local rate = tonumber(ARGV[i * 2 + 1])
+    local bucket = redis.call('HMGET', key, 'tokens', 'ts')
+    local tokens = tonumber(bucket[1]) or capacity
+    local elapsed = math.max(0, now - (tonumber(bucket[2]) or now))
+
+    levels[i] = math.min(capacity, tokens + elapsed * rate)
+    waits[i] = 0
+    if levels[i] < 1 then
+        waits[i] = math.ceil((1 - levels[i]) / rate)
+        empty = true
+    end
+end
+
+if empty then
+    return waits
+end
+
+for i, key in ipairs(KEYS) do
+    local capacity = tonumber(ARGV[i * 2])
+    local rate = tonumber(ARGV[i * 2 + 1])
+
+    redis.call('HMSET', key, 'tokens', levels[i] - 1, 'ts', now)
+    redis.call('PEXPIRE', key, math.ceil(capacity / rate))
+end
+
+return waits
+"""
+
+_script = None
+_blocked = None
+
+
+def parse_rate(rate):
+    """Return (capacity, tokens per millisecond) for a rate such as '10/min'."""
+    count, period = rate.split('/')
+
+    return int(count), int(count) / (PERIODS[period] * 1000)
+
+
+def _get_script():
+    global _script
+
+    if _script is None:
+        _script = get_redis().register_script(TAKE)
+
+    return _script
+
+
+def _get_blocked():
+    global _blocked
+
+    if _blocked is None:
+        # Entries carry their own deadline; the TTL only bounds how long a stale one lingers.
+        _blocked = LRUCache(settings.PUBLIC_THROTTLE_LOCAL_SIZE, settings.PUBLIC_THROTTLE_LOCAL_TTL)
+
+    return _blocked
+
+
+def take(buckets):
+    """
+    Draw a token from each of ``buckets``, a list of (key, rate) pairs, and
+    return 0 or the seconds to wait before retrying.
+    """
+    blocked = _get_blocked()
+    now = time.monotonic()
+
+    for key, _ in buckets:
+        until = blocked.get(key)
+        if until is not None and until > now:
+            metrics.incr('throttle.rejected_local')
+            return until - now
+
+    args = [int(time.time() * 1000)]
+    for _, rate in buckets:
+        args.extend(parse_rate(rate))
+
+    try:
+        waits = [wait / 1000 for wait in _get_script()(keys=[key for key, _ in buckets], args=args)]
+    except redis.RedisError:
+        logger.warning('Throttle check failed, letting the request through', exc_info=True)
+        metrics.incr('throttle.unavailable')
+        return 0
+
+    if any(waits):
+        metrics.incr('throttle.rejected')
+        # Only the empty buckets are remembered, so one hot IP cannot lock an email out elsewhere.
+        for (key, _), wait in zip(buckets, waits):
+            if wait:
+                blocked.set(key, now + wait)
+
+    return max(waits)
+
+
+class PublicEndpointThrottle(BaseThrottle):
+    """Token buckets per client IP and per target email, see PUBLIC_THROTTLE_*_RATE."""
+
+    def allow_request(self, request, view):
+        buckets = [(f'accounts:throttle:ip:{self.get_ident(request)}', settings.PUBLIC_THROTTLE_IP_RATE)]
+
+        email = request.data.get('email') if hasattr(request.data, 'get') else None
+        if isinstance(email, str) and email:
+            buckets.append((f'accounts:throttle:email:{email.strip().lower()}', settings.PUBLIC_THROTTLE_EMAIL_RATE))
+
+        self._wait = take(buckets)
+
+        return not self._wait
+
+    def wait(self):
+        return math.ceil(self._wait)
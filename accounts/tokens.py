@@ -0,0 +1,127 @@
+"""
+Verification and password reset token backends, selected by
+ACCOUNT_TOKEN_BACKEND.
+
+DatabaseTokenBackend stores a Token row per flow. SignedTokenBackend issues
+HMAC-signed tokens carrying the user id, type and expiry, so no row is
+written; one-time use comes from the state the token changes (is_verified for
+VERIFY, a marker of the current password hash for RESET) and each confirm is
+a single conditional UPDATE.
+"""
+import datetime
+import time
+
+from django.conf import settings
+from django.core import signing
+from django.http import Http404
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from rest_framework.exceptions import APIException
+
+from accounts import authentication, hashing, shards
+from accounts.models import Token, User
+
+
+def get_backend():
+    return import_string(settings.ACCOUNT_TOKEN_BACKEND)()
+
+
+class DatabaseTokenBackend(object):
+    def issue(self, user, type, hours=None):
+        token = Token(user=user, type=type)
+        token.save(hours=hours or settings.ACCOUNT_TOKEN_HOURS)
+
+        return str(token.id)
+
+    def _load(self, value, type):
+        token = shards.get_object_or_404(Token.objects.select_related('user'), pk=value, type=type)
+
+        # If token is older than expiration timestamp, it's expired, user must request a new token.
+        if token.expires.replace(tzinfo=None) < datetime.datetime.now():
+            raise APIException(detail='Token expired')
+
+        return token
+
+    def confirm_user(self, value):
+        token = self._load(value, 'VERIFY')
+
+        token.user.is_verified = True
+        token.user.save()
+
+        # After user is verified, remove the token
+        token.delete()
+
+    def change_password(self, value, password):
+        token = self._load(value, 'RESET')
+
+        token.user.set_password(password)
+        token.user.save()
+
+        token.delete()
+
+    def revoke(self, user):
+        # The related manager routes to the user's shard.
+        user.token_set.all().delete()
+
+
+class SignedTokenBackend(object):
+    salt = 'accounts.tokens'
+
+    def issue(self, user, type, hours=None):
+        expires = time.time() + 3600 * (hours or settings.ACCOUNT_TOKEN_HOURS)
+        payload = {'u': str(user.pk), 't': type, 'e': int(expires)}
+
+        if type == 'RESET':
+            payload['m'] = authentication.password_marker(user.password)
+
+        return signing.dumps(payload, salt=self.salt, compress=True)
+
+    def _load(self, value, type):
+        try:
+            payload = signing.loads(value, salt=self.salt)
+        except signing.BadSignature:
+            raise Http404
+
+        if payload.get('t') != type:
+            raise Http404
+
+        if payload['e'] < time.time():
+            raise APIException(detail='Token expired')
+
+        return payload
+
+    def confirm_user(self, value):
+        payload = self._load(value, 'VERIFY')
+
+        users = shards.locate(User.objects, pk=payload['u'])
+        updated = users.filter(is_verified=False).update(is_verified=True, last_updated=timezone.now())
+
+        # Nothing to update means the token was already used.
+        if not updated:
+            raise Http404
+
+        authentication.invalidate(payload['u'])
+
+    def change_password(self, value, password):
+        payload = self._load(value, 'RESET')
+
+        users = shards.locate(User.objects, pk=payload['u'])
+
+        row = users.values_list('email', 'password').first()
+        if row is None or authentication.password_marker(row[1]) != payload['m']:
+            raise Http404
+
+        email, current = row
+
+        # Compare-and-set on the old hash, so two uses of one token can't both win.
+        updated = users.filter(password=current) \
+                       .update(password=hashing.make_password(password), last_updated=timezone.now())
+        if not updated:
+            raise Http404
+
+        authentication.invalidate(payload['u'], email)
+
+    def revoke(self, user):
+        # Signed tokens can't be revoked individually; they lapse at expiry
+        # or once the state they change has moved on.
+        pass
@@ -7,5 +7,6 @@ router = routers.SimpleRouter()
 
 router.register('register', views.RegisterViewSet, base_name='register')
 router.register('user', views.UserViewSet)
+router.register('metrics', views.MetricsViewSet, base_name='metrics')
 
 urlpatterns = router.urls
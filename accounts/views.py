@@ -1,21 +1,33 @@
-import datetime
+from django.conf import settings
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
 from rest_framework import status
-from rest_framework.decorators import permission_classes
-from rest_framework.exceptions import APIException
-from rest_framework.generics import get_object_or_404
-from rest_framework.permissions import AllowAny
+from rest_framework.decorators import action, permission_classes
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import JSONParser
+from rest_framework.permissions import AllowAny, IsAdminUser
+from rest_framework.renderers import BrowsableAPIRenderer
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from rest_framework_jwt.serializers import JSONWebTokenSerializer
 from rest_framework_jwt.views import JSONWebTokenAPIView
 
-from accounts import tasks
+from accounts import (batch, bloom, changes, export, metrics, publisher, registration, response_cache, shards, tasks,
+                      tokens)
 from accounts.models import User, Token
+from accounts.pagination import UserCursorPagination
+from accounts.parsers import JSONLinesParser
 from accounts.permissions import PublicEndpoint
-from accounts.serializers import UserSerializer
+from accounts.renderers import FastJSONRenderer
+from accounts.serializers import UserRowSerializer, UserSerializer
+from accounts.throttling import PublicEndpointThrottle
 from rest_framework.viewsets import ModelViewSet, ViewSet
+from starter.routers import ReplicaReadMixin
 
 
-class VerifyViewSet(JSONWebTokenAPIView):
+class VerifyViewSet(ReplicaReadMixin, JSONWebTokenAPIView):
     """
     API View that receives a POST with a user's email and password.
     Returns a JSON Web Token that can be used for authenticated requests.
@@ -56,19 +68,42 @@ class RegisterViewSet(ViewSet):
 
     serializer_class = UserSerializer
     permission_classes = (PublicEndpoint,)
+    authentication_classes = ()
+    throttle_classes = (PublicEndpointThrottle,)
 
     def create(self, request, *args, **kwargs):
         serializer = UserSerializer(data=request.data)
 
         if serializer.is_valid():
             serializer.save()
-            tasks.message.delay('verify', recipient=request.data['email'])
+            tasks.enqueue_message('verify', request.data['email'])
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=False, methods=['post'], url_path='bulk',
+            permission_classes=(IsAdminUser,), parser_classes=(JSONParser, JSONLinesParser),
+            authentication_classes=api_settings.DEFAULT_AUTHENTICATION_CLASSES, throttle_classes=())
+    def bulk(self, request, *args, **kwargs):
+        """
+        Register many users from a JSON array or a JSON Lines body.
+        Returns a status per input row: created, exists, duplicate or invalid.
+        """
+        rows = request.data
 
-class UserViewSet(ModelViewSet):
+        if not isinstance(rows, list):
+            raise ValidationError('Expected a JSON array or JSON Lines body.')
+
+        if len(rows) > settings.BULK_REGISTER_MAX_ROWS:
+            raise ValidationError(f'At most {settings.BULK_REGISTER_MAX_ROWS} users can be registered at once.')
+
+        results = registration.register_users(rows)
+        created = sum(1 for result in results if result['status'] == registration.CREATED)
+
+        return Response({'created': created, 'results': results}, status=status.HTTP_207_MULTI_STATUS)
+
+
+class UserViewSet(ReplicaReadMixin, ModelViewSet):
     """
     API View that receives a GET to query a user by ID
     Return User model as JSON
@@ -78,6 +113,151 @@ class UserViewSet(ModelViewSet):
 
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    pagination_class = UserCursorPagination
+    renderer_classes = (FastJSONRenderer, BrowsableAPIRenderer)
+    replica_actions = ('list', 'retrieve', 'batch')
+
+    def requested_fields(self):
+        """The validated ``?fields=`` selection, or None for the serializer's defaults."""
+        if not hasattr(self, '_requested_fields'):
+            self._requested_fields = UserSerializer.parse_fields(self.request.query_params.get('fields'))
+
+        return self._requested_fields
+
+    def get_queryset(self):
+        fields = self.requested_fields()
+
+        if self.action == 'list':
+            # Just the columns UserRowSerializer and the pagination cursor read.
+            return User.objects.values_list(*UserRowSerializer.columns(fields), named=True)
+
+        if self.action == 'retrieve':
+            return UserSerializer.prune(super().get_queryset(), fields)
+
+        return super().get_queryset()
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.requested_fields())
+
+        return super().get_serializer(*args, **kwargs)
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return UserRowSerializer
+
+        return super().get_serializer_class()
+
+    def get_object(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+
+        obj = shards.get_object_or_404(queryset, **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        self.check_object_permissions(self.request, obj)
+
+        return obj
+
+    def retrieve(self, request, *args, **kwargs):
+        """
+        ETag and Last-Modified come from the user's and its role's
+        last_updated alone, so a conditional request that matches gets a 304
+        after one narrow query and the row is never loaded. JSON bodies may be served from the Redis
+        response cache (USER_RESPONSE_CACHE).
+        """
+        pk = self.kwargs[self.lookup_url_kwarg or self.lookup_field]
+
+        try:
+            versions = shards.locate(self.get_queryset(), pk=pk) \
+                .values_list('last_updated', 'role__last_updated') \
+                .first()
+        except (TypeError, ValueError, DjangoValidationError):
+            raise Http404
+
+        if versions is None:
+            raise Http404
+
+        etag, last_modified = response_cache.validators(*versions)
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is not None:
+            metrics.incr('user.not_modified')
+        else:
+            response = self.render_user(request, pk, etag)
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+
+        return response
+
+    @action(detail=False, methods=['post'], url_path='batch')
+    def batch(self, request, *args, **kwargs):
+        """
+        Look up many users at once from ``{"ids": [...], "emails": [...]}``.
+        Results are keyed by the values given, with misses as null and listed
+        under ``missing``.
+        """
+        message = 'Expected an object with lists of ids and/or emails.'
+
+        if not isinstance(request.data, dict):
+            raise ValidationError(message)
+
+        ids = request.data.get('ids') or []
+        emails = request.data.get('emails') or []
+
+        if not isinstance(ids, list) or not isinstance(emails, list) or \
+                not all(isinstance(value, str) for value in ids + emails):
+            raise ValidationError(message)
+
+        if len(ids) + len(emails) > settings.USER_BATCH_MAX_SIZE:
+            raise ValidationError(f'At most {settings.USER_BATCH_MAX_SIZE} users can be looked up at once.')
+
+        return Response(batch.get_users(ids, emails, self.requested_fields()))
+
+    @action(detail=False, methods=['get'], url_path='export', permission_classes=(IsAdminUser,))
+    def export(self, request, *args, **kwargs):
+        """
+        Stream every user as ``?output=csv`` (default) or ``jsonl``, gzipped
+        with ``?gzip=true``. Memory use is flat regardless of table size.
+        """
+        output = request.query_params.get('output', 'csv')
+        compress = request.query_params.get('gzip') == 'true'
+
+        if output not in export.FORMATS:
+            raise ValidationError({'output': f'Choose from {", ".join(export.FORMATS)}.'})
+
+        filename = f'users.{output}.gz' if compress else f'users.{output}'
+        response = StreamingHttpResponse(export.stream(output, compress),
+                                         content_type='application/gzip' if compress else export.CONTENT_TYPES[output])
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+
+        return response
+
+    @action(detail=False, methods=['get'], url_path='changes')
+    def changes(self, request, *args, **kwargs):
+        """
+        Users changed or deleted since the ``since`` cursor, oldest first.
+        Pass the returned cursor back to resume; has_more means call again.
+        """
+        try:
+            limit = min(int(request.query_params.get('limit', settings.CHANGES_FEED_PAGE_SIZE)),
+                        settings.CHANGES_FEED_MAX_PAGE_SIZE)
+        except ValueError:
+            raise ValidationError({'limit': 'Expected an integer.'})
+
+        return Response(changes.read_changes(request.query_params.get('since'), max(limit, 1)))
+
+    def render_user(self, request, pk, etag):
+        if not settings.USER_RESPONSE_CACHE or request.accepted_renderer.format != 'json':
+            return super().retrieve(request)
+
+        variant = f'{etag}:{request.accepted_media_type}:{request.META.get("QUERY_STRING", "")}'
+
+        body = response_cache.get_response(pk, variant)
+        if body is None:
+            data = super().retrieve(request).data
+            body = request.accepted_renderer.render(data, request.accepted_media_type, self.get_renderer_context())
+            response_cache.store_response(pk, variant, body)
+
+        return HttpResponse(body, content_type=request.accepted_media_type)
 
 
 class UserRoleViewSet(ViewSet):
@@ -90,6 +270,17 @@ class UserRoleViewSet(ViewSet):
     serializer_class = UserSerializer
 
 
+class MetricsViewSet(ViewSet):
+    """
+    Report the serving worker process's counters, gauges and timings
+    """
+
+    permission_classes = (IsAdminUser,)
+
+    def list(self, request, *args, **kwargs):
+        return Response(metrics.snapshot())
+
+
 class ConfirmUserViewSet(ViewSet):
     """
     Confirm a user's email address
@@ -98,21 +289,13 @@ class ConfirmUserViewSet(ViewSet):
     queryset = Token.objects.all()
     lookup_field = 'id'
     permission_classes = (PublicEndpoint,)
+    authentication_classes = ()
+    throttle_classes = (PublicEndpointThrottle,)
 
     def confirm(self, request, *args, **kwargs):
         _id = request.query_params.get('id')
-        token = get_object_or_404(self.queryset, pk=_id)
-
-        # If token is older than expiration timestamp, it's expired, user must request a new token.
-        # Reset current datetime to minus 5 hours to sync with Reelio's timezone
-        if token.expires.replace(tzinfo=None) < datetime.datetime.now():
-            raise APIException(detail='Token expired')
 
-        token.user.is_verified = True
-        token.user.save()
-
-        # After user is verified, remove the token
-        token.delete()
+        tokens.get_backend().confirm_user(_id)
 
         return Response()
 
@@ -124,17 +307,21 @@ class ResetConfirmUserToken(ViewSet):
 
     queryset = User.objects.all()
     permission_classes = (PublicEndpoint,)
+    authentication_classes = ()
+    throttle_classes = (PublicEndpointThrottle,)
 
     def confirm(self, request, *args, **kwargs):
         email = request.data['email']
 
-        user = get_object_or_404(self.queryset, email=email)
+        if not bloom.might_exist(email):
+            raise Http404
 
-        tokens = Token.objects.filter(user=user)
-        for token in tokens:
-            token.delete()
+        user = shards.get_object_or_404(self.queryset, email__lower=email.lower())
 
-        tasks.message.delay('verify', recipient=email)
+        # Only replace outstanding tokens when a new message will actually go out.
+        if tasks.claim_message('verify', email):
+            tokens.get_backend().revoke(user)
+            publisher.publish(tasks.message, 'verify', recipient=email)
 
         return Response()
 
@@ -146,13 +333,18 @@ class PasswordChangeRequestViewSet(ViewSet):
 
     queryset = User.objects.all()
     permission_classes = (PublicEndpoint,)
+    authentication_classes = ()
+    throttle_classes = (PublicEndpointThrottle,)
 
     def create(self, request, *args, **kwargs):
         email = request.data['email']
 
-        get_object_or_404(self.queryset, email=email)
+        if not bloom.might_exist(email):
+            raise Http404
+
+        shards.get_object_or_404(self.queryset, email__lower=email.lower())
 
-        tasks.message.delay('reset', recipient=email)
+        tasks.enqueue_message('reset', email)
 
         return Response()
 
@@ -164,21 +356,13 @@ class PasswordChangeViewSet(ViewSet):
 
     queryset = Token.objects.all()
     permission_classes = (PublicEndpoint,)
+    authentication_classes = ()
+    throttle_classes = (PublicEndpointThrottle,)
 
     def change(self, request, *args, **kwargs):
         _id = self.kwargs.get('id')
         password = request.data['password']
 
-        token = get_object_or_404(self.queryset, pk=_id)
-
-        # If token is older than expiration timestamp, it's expired, user must request a new token.
-        if token.expires.replace(tzinfo=None) < datetime.datetime.now():
-            raise APIException(detail='Token expired')
-
-        token.user.set_password(password)
-
-        token.user.save()
-
-        token.delete()
+        tokens.get_backend().change_password(_id, password)
 
         return Response()
@@ -0,0 +1,19 @@
+"""
+ASGI config for starter project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+
+Django 2.1 has no native ASGI handler, so the regular WSGI application is
+adapted with asgiref: the event loop accepts and parses connections while each
+request runs on a thread pool sized by the ASGI_THREADS environment variable.
+Run it with ``SERVER=asgi ./bin/boot``.
+"""
+
+import os
+
+from asgiref.wsgi import WsgiToAsgi
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'starter.settings')
+
+application = WsgiToAsgi(get_wsgi_application())
@@ -1,6 +1,145 @@
 from __future__ import unicode_literals, absolute_import, print_function
 
+import contextlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import request_finished, request_started
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
 from rest_framework import routers
 
+logger = logging.getLogger(__name__)
 
 v1_router = routers.DefaultRouter()
+
+_state = threading.local()
+
+
+@contextlib.contextmanager
+def read_from_replica():
+    """
+    Let reads inside the block go to a replica. Once anything in the current
+    request writes, reads stay pinned to the primary so it sees its own writes.
+    """
+    previous = getattr(_state, 'replica', False)
+    _state.replica = True
+    try:
+        yield
+    finally:
+        _state.replica = previous
+
+
+@contextlib.contextmanager
+def read_from_primary():
+    """Send reads inside the block to the primary, even within read_from_replica()."""
+    previous = getattr(_state, 'replica', False)
+    _state.replica = False
+    try:
+        yield
+    finally:
+        _state.replica = previous
+
+
+def reset(**kwargs):
+    _state.replica = False
+    _state.pinned = False
+
+
+request_started.connect(reset)
+request_finished.connect(reset)
+
+
+class ReplicaReadMixin(object):
+    """
+    View mixin that serves ``replica_actions`` (every method when None) from
+    a read replica.
+
+    Authentication and permission checks still read the primary: they fill
+    the auth and permission caches, and state read from a lagging replica
+    would outlive the invalidation of a deactivation or revoked permission.
+    """
+
+    replica_actions = None
+
+    def initial(self, request, *args, **kwargs):
+        with read_from_primary():
+            super().initial(request, *args, **kwargs)
+
+    def dispatch(self, request, *args, **kwargs):
+        action = getattr(self, 'action_map', {}).get(request.method.lower())
+
+        if self.replica_actions is None or action in self.replica_actions:
+            with read_from_replica():
+                return super().dispatch(request, *args, **kwargs)
+
+        return super().dispatch(request, *args, **kwargs)
+
+
+class ReplicaRouter(object):
+    """
+    Sends reads made inside read_from_replica() to the replicas in
+    DATABASE_REPLICA_WEIGHTS using smooth weighted round-robin. A replica that
+    can't be reached is skipped for REPLICA_RETRY_SECONDS; with none left,
+    reads fall back to the primary. Writes always go to the primary.
+    """
+
+    def __init__(self, weights=None):
+        self.weights = settings.DATABASE_REPLICA_WEIGHTS if weights is None else weights
+        self._current = {alias: 0 for alias in self.weights}
+        self._down_until = {}
+        self._lock = threading.Lock()
+
+    def _is_available(self, alias):
+        if self._down_until.get(alias, 0) > time.monotonic():
+            return False
+
+        try:
+            connections[alias].ensure_connection()
+        except DatabaseError:
+            logger.warning('Replica %s is unreachable, reading from the primary', alias, exc_info=True)
+            self._down_until[alias] = time.monotonic() + settings.REPLICA_RETRY_SECONDS
+            return False
+
+        return True
+
+    def _next_replica(self, exclude):
+        with self._lock:
+            candidates = {alias: weight for alias, weight in self.weights.items() if alias not in exclude}
+            if not candidates:
+                return None
+
+            for alias, weight in candidates.items():
+                self._current[alias] += weight
+
+            chosen = max(candidates, key=lambda alias: self._current[alias])
+            self._current[chosen] -= sum(candidates.values())
+
+            return chosen
+
+    def db_for_read(self, model, **hints):
+        if not getattr(_state, 'replica', False) or getattr(_state, 'pinned', False):
+            return DEFAULT_DB_ALIAS
+
+        tried = set()
+        while True:
+            alias = self._next_replica(tried)
+            if alias is None:
+                return DEFAULT_DB_ALIAS
+
+            if self._is_available(alias):
+                return alias
+
+            tried.add(alias)
+
+    def db_for_write(self, model, **hints):
+        _state.pinned = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas mirror the primary, so objects from any of them may relate.
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -12,6 +12,9 @@ https://docs.djangoproject.com/en/2.1/ref/settings/
 
 import os
 
+from celery.schedules import crontab
+from kombu import Exchange, Queue
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
@@ -98,15 +101,120 @@ DATABASES = {
         'USER': 'start',
         'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
         'HOST': os.getenv('POSTGRES_HOST'),
-        'PORT': '5432',
+        'PORT': os.getenv('POSTGRES_PORT', '5432'),
+        # Keep connections open across requests; accounts.db pings idle ones before reuse.
+        'CONN_MAX_AGE': int(os.getenv('POSTGRES_CONN_MAX_AGE', 300)),
+        # Behind PgBouncer in transaction pooling mode a cursor can't outlive its
+        # transaction. psycopg2 never uses server-side prepared statements.
+        'DISABLE_SERVER_SIDE_CURSORS': os.getenv('POSTGRES_PGBOUNCER') == 'true',
     }
 }
 
+# Read replicas, e.g. POSTGRES_REPLICAS="replica-1:3,replica-2:1" (host:weight). Each becomes
+# a replica_<n> alias; starter.routers.ReplicaRouter spreads replica-eligible reads across them.
+
+DATABASE_REPLICA_WEIGHTS = {}
+
+for index, entry in enumerate(filter(None, os.getenv('POSTGRES_REPLICAS', '').split(','))):
+    host, _, weight = entry.strip().partition(':')
+    alias = f'replica_{index}'
+
+    DATABASES[alias] = dict(DATABASES['default'], HOST=host, TEST={'MIRROR': 'default'})
+    DATABASE_REPLICA_WEIGHTS[alias] = int(weight or 1)
+
+# Hash-sharded users, e.g. POSTGRES_SHARDS="shard-1,shard-2" (hosts). The default database is
+# shard 0 and each host becomes a shard_<n> alias, see accounts.shards. Only ever append hosts,
+# then run ./manage.py rebalance_shards to move users onto the new shards.
+
+DATABASE_SHARDS = ['default']
+
+for index, host in enumerate(filter(None, os.getenv('POSTGRES_SHARDS', '').split(',')), start=1):
+    alias = f'shard_{index}'
+
+    DATABASES[alias] = dict(DATABASES['default'], HOST=host.strip())
+    DATABASE_SHARDS.append(alias)
+
+DATABASE_ROUTERS = ['accounts.shards.ShardRouter', 'starter.routers.ReplicaRouter']
+
+# Seconds an unreachable replica is skipped before we try it again
+REPLICA_RETRY_SECONDS = int(os.getenv('REPLICA_RETRY_SECONDS', 30))
+
+# Seconds a persistent connection may sit idle before it is health-checked on reuse
+DB_HEALTH_CHECK_IDLE = int(os.getenv('DB_HEALTH_CHECK_IDLE', 10))
+
 # Redis
 
 REDIS_HOST = os.getenv('REDIS_HOST')
 BROKER_URL = f'redis://{REDIS_HOST}:6379/0'
 RESULTS_BACKEND_URL = f'redis://{REDIS_HOST}:6379/1'
+REDIS_CACHE_URL = f'redis://{REDIS_HOST}:6379/2'
+REDIS_CACHE_TIMEOUT = float(os.getenv('REDIS_CACHE_TIMEOUT', 0.5))
+
+# Authentication cache: a per-process LRU in front of Redis, see accounts.authentication
+
+AUTH_CACHE_LOCAL_SIZE = int(os.getenv('AUTH_CACHE_LOCAL_SIZE', 1024))
+AUTH_CACHE_LOCAL_TTL = int(os.getenv('AUTH_CACHE_LOCAL_TTL', 5))
+AUTH_CACHE_REDIS_TTL = int(os.getenv('AUTH_CACHE_REDIS_TTL', 300))
+
+# Role table cached in every process and compiled per-user permission sets cached in Redis,
+# see accounts.permission_cache
+
+AUTHENTICATION_BACKENDS = ['accounts.permission_cache.CachedModelBackend']
+ROLE_CACHE_TTL = int(os.getenv('ROLE_CACHE_TTL', 60))
+PERMISSION_CACHE_TTL = int(os.getenv('PERMISSION_CACHE_TTL', 300))
+
+# Redis token buckets for the public endpoints, see accounts.throttling. Rates are
+# requests/period (s, min, h or d) and the count is also the burst allowed.
+
+PUBLIC_THROTTLE_IP_RATE = os.getenv('PUBLIC_THROTTLE_IP_RATE', '60/min')
+PUBLIC_THROTTLE_EMAIL_RATE = os.getenv('PUBLIC_THROTTLE_EMAIL_RATE', '10/min')
+PUBLIC_THROTTLE_LOCAL_SIZE = int(os.getenv('PUBLIC_THROTTLE_LOCAL_SIZE', 10000))
+PUBLIC_THROTTLE_LOCAL_TTL = int(os.getenv('PUBLIC_THROTTLE_LOCAL_TTL', 3600))
+
+# Reverse proxies in front of gunicorn that append to X-Forwarded-For. The
+# client IP the buckets are keyed on is taken that many entries from the end of
+# the header; with 0, the default as gunicorn is exposed directly, the header is
+# ignored and REMOTE_ADDR is used, so clients cannot pick their own bucket.
+
+NUM_PROXIES = int(os.getenv('NUM_PROXIES', 0))
+
+# Rendered GET /v1/user/<id>/ bodies cached in Redis, see accounts.response_cache
+USER_RESPONSE_CACHE = os.getenv('USER_RESPONSE_CACHE') == 'true'
+USER_RESPONSE_CACHE_TTL = int(os.getenv('USER_RESPONSE_CACHE_TTL', 300))
+
+# POST /v1/user/batch/, see accounts.batch
+USER_BATCH_MAX_SIZE = int(os.getenv('USER_BATCH_MAX_SIZE', 1000))
+USER_BATCH_CHUNK_SIZE = int(os.getenv('USER_BATCH_CHUNK_SIZE', 500))
+
+# Rows fetched per server-side cursor round trip by the user export, see accounts.export
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', 2000))
+
+# GET /v1/user/changes/, see accounts.changes. Tombstones of deleted users are kept this many days;
+# older cursors get 410 Gone and must resync.
+CHANGES_FEED_PAGE_SIZE = int(os.getenv('CHANGES_FEED_PAGE_SIZE', 500))
+CHANGES_FEED_MAX_PAGE_SIZE = int(os.getenv('CHANGES_FEED_MAX_PAGE_SIZE', 5000))
+CHANGES_FEED_LAG_SECONDS = int(os.getenv('CHANGES_FEED_LAG_SECONDS', 5))
+USER_TOMBSTONE_RETENTION_DAYS = int(os.getenv('USER_TOMBSTONE_RETENTION_DAYS', 30))
+
+# Email is buffered in Redis and sent in batches over a reused connection, see accounts.mail
+
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_HOST = os.getenv('EMAIL_HOST', 'localhost')
+EMAIL_PORT = int(os.getenv('EMAIL_PORT', 25))
+EMAIL_HOST_USER = os.getenv('EMAIL_HOST_USER', '')
+EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD', '')
+EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS') == 'true'
+EMAIL_TIMEOUT = int(os.getenv('EMAIL_TIMEOUT', 10))
+EMAIL_FILE_PATH = os.getenv('EMAIL_FILE_PATH', '/tmp/app-messages')
+DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'no-reply@localhost')
+
+# Identical (command, recipient) messages enqueued within this window are dropped
+MESSAGE_DEDUP_SECONDS = int(os.getenv('MESSAGE_DEDUP_SECONDS', 60))
+
+MAIL_BATCH_SIZE = int(os.getenv('MAIL_BATCH_SIZE', 100))
+MAIL_FLUSH_INTERVAL_MS = int(os.getenv('MAIL_FLUSH_INTERVAL_MS', 1000))
+MAIL_MAX_BATCHES = int(os.getenv('MAIL_MAX_BATCHES', 50))
+MAIL_DRAIN_LOCK_MS = int(os.getenv('MAIL_DRAIN_LOCK_MS', 60000))
 
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
@@ -126,10 +234,58 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing runs on a bounded executor per worker process, see accounts.hashing.
+# WORKERS is per gunicorn worker, so by default the cores are split between the
+# GUNICORN_WORKERS bin/boot starts rather than each of them claiming all of them.
+
+PASSWORD_HASHING_EXECUTOR = os.getenv('PASSWORD_HASHING_EXECUTOR', 'accounts.hashing.ProcessPoolHashingExecutor')
+PASSWORD_HASHING_WORKERS = int(os.getenv('PASSWORD_HASHING_WORKERS',
+                                         max(1, (os.cpu_count() or 1) // int(os.getenv('GUNICORN_WORKERS', 1)))))
+PASSWORD_HASHING_MAX_QUEUE = int(os.getenv('PASSWORD_HASHING_MAX_QUEUE', 2 * PASSWORD_HASHING_WORKERS))
+PASSWORD_HASHING_TIMEOUT = int(os.getenv('PASSWORD_HASHING_TIMEOUT', 10))
+PASSWORD_HASHING_RETRY_AFTER = int(os.getenv('PASSWORD_HASHING_RETRY_AFTER', 1))
+
+# Verification and reset tokens: 'accounts.tokens.DatabaseTokenBackend' stores a
+# Token row per flow, 'accounts.tokens.SignedTokenBackend' issues stateless signed tokens.
+
+ACCOUNT_TOKEN_BACKEND = os.getenv('ACCOUNT_TOKEN_BACKEND', 'accounts.tokens.DatabaseTokenBackend')
+ACCOUNT_TOKEN_HOURS = int(os.getenv('ACCOUNT_TOKEN_HOURS', 24))
+
+# Links sent in verify and reset emails, {token} is replaced with the issued token
+ACCOUNT_LINKS = {
+    'verify': os.getenv('ACCOUNT_VERIFY_LINK', 'http://localhost:8001/verify/?token={token}'),
+    'reset': os.getenv('ACCOUNT_RESET_LINK', 'http://localhost:8001/reset/{token}/'),
+}
+
+# accounts.tasks.purge_expired_tokens deletes this many rows per batch, pausing between batches
+TOKEN_PURGE_BATCH_SIZE = int(os.getenv('TOKEN_PURGE_BATCH_SIZE', 1000))
+TOKEN_PURGE_PAUSE = float(os.getenv('TOKEN_PURGE_PAUSE', 0.1))
+
+# Bulk registration, see accounts.registration. Every row is hashed within the
+# request, so MAX_ROWS keeps a batch inside gunicorn's 30 second worker timeout
+# (PBKDF2 takes about 100ms per password per hashing worker). Larger user bases
+# go through the import_users command.
+
+BULK_REGISTER_MAX_ROWS = int(os.getenv('BULK_REGISTER_MAX_ROWS', 1000))
+BULK_REGISTER_CHUNK_SIZE = int(os.getenv('BULK_REGISTER_CHUNK_SIZE', 1000))
+BULK_REGISTER_BATCH_SIZE = int(os.getenv('BULK_REGISTER_BATCH_SIZE', 500))
+
+# Bloom filter of registered emails, see accounts.bloom; rebuild_email_bloom builds it. Its
+# size is fixed by CAPACITY and ERROR_RATE whatever the number of users: the defaults take
+# about 17 MiB in Redis and again in every process, so size CAPACITY to the expected user base.
+
+EMAIL_BLOOM_CAPACITY = int(os.getenv('EMAIL_BLOOM_CAPACITY', 10000000))
+EMAIL_BLOOM_ERROR_RATE = float(os.getenv('EMAIL_BLOOM_ERROR_RATE', 0.001))
+EMAIL_BLOOM_LOCAL_TTL = int(os.getenv('EMAIL_BLOOM_LOCAL_TTL', 300))
+
+# Records hashed, COPYed and merged together by the import_users command, see accounts.importer
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', 5000))
+
 # Django Rest Framework
 
 REST_FRAMEWORK = {
     'DATETIME_FORMAT': None,
+    'NUM_PROXIES': NUM_PROXIES,
     'DATE_FORMAT': None,
     'UNICODE_JSON': False,
     'TEST_REQUEST_RENDERER_CLASSES': (
@@ -140,12 +296,16 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_jwt.authentication.JSONWebTokenAuthentication',
+        'accounts.authentication.CachedJSONWebTokenAuthentication',
         # 'rest_framework.authentication.SessionAuthentication',
         # 'rest_framework.authentication.BasicAuthentication',
     ),
 }
 
+JWT_AUTH = {
+    'JWT_PAYLOAD_HANDLER': 'accounts.authentication.jwt_payload_handler',
+}
+
 ##############################################################################
 #
 # CELERY CONFIG
@@ -153,21 +313,69 @@ REST_FRAMEWORK = {
 
 # http://docs.celeryproject.org/en/latest/django/first-steps-with-django.html#first-steps-with-django
 
-# http://docs.celeryproject.org/en/latest/userguide/routing.html#specifying-task-destination
-CELERY_ROUTES = ()
 CELERY_ACCEPT_CONTENT = ['application/json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 
-CELERY_DEFAULT_QUEUE = 'real_time'
-CELERY_DEFAULT_EXCHANGE_TYPE = 'direct'
-CELERY_DEFAULT_ROUTING_KEY = 'real_time'
+# With namespace='CELERY' only the new-style names (task_default_queue -> CELERY_TASK_DEFAULT_QUEUE) apply.
+CELERY_TASK_DEFAULT_QUEUE = 'real_time'
+CELERY_TASK_DEFAULT_EXCHANGE_TYPE = 'direct'
+CELERY_TASK_DEFAULT_ROUTING_KEY = 'real_time'
+
+# http://docs.celeryproject.org/en/latest/userguide/routing.html#specifying-task-destination
+# real_time: user-facing email, must never wait behind bulk or maintenance work.
+# bulk: batch fan-out such as bulk registration messages.
+# maintenance: scheduled housekeeping.
+# bin/boot starts a worker per queue set with its own concurrency and prefetch (WORKER_QUEUES).
+CELERY_TASK_QUEUES = (
+    Queue('real_time', Exchange('real_time', type='direct'), routing_key='real_time'),
+    Queue('bulk', Exchange('bulk', type='direct'), routing_key='bulk'),
+    Queue('maintenance', Exchange('maintenance', type='direct'), routing_key='maintenance'),
+)
+
+CELERY_TASK_ROUTES = {
+    'accounts.tasks.message': {'queue': 'real_time', 'priority': 0},
+    'accounts.tasks.drain_outbox': {'queue': 'real_time', 'priority': 3},
+    'accounts.tasks.message_batch': {'queue': 'bulk'},
+    'accounts.tasks.purge_expired_tokens': {'queue': 'maintenance'},
+    'accounts.tasks.purge_tombstones': {'queue': 'maintenance'},
+}
+
+# The Redis transport emulates priorities with one list per step; 0 is served first.
+CELERY_BROKER_TRANSPORT_OPTIONS = {
+    'priority_steps': list(range(10)),
+    'visibility_timeout': 3600,
+}
+CELERY_TASK_DEFAULT_PRIORITY = 5
+
+# Publish from a background thread so requests don't wait on the broker, see accounts.publisher
+CELERY_PUBLISH_IN_BACKGROUND = os.getenv('CELERY_PUBLISH_IN_BACKGROUND') == 'true'
+CELERY_PUBLISH_QUEUE_SIZE = int(os.getenv('CELERY_PUBLISH_QUEUE_SIZE', 1000))
+
+# Our tasks are fire-and-forget; don't write their results to RESULTS_BACKEND_URL.
+# Tasks whose result is awaited opt back in with @app.task(ignore_result=False).
+CELERY_TASK_IGNORE_RESULT = True
 
 # http://docs.celeryproject.org/en/latest/userguide/tasks.html#disable-rate-limits-if-they-re-not-used
 # CELERY_DISABLE_RATE_LIMITS = True
 
 CELERY_TIMEZONE = 'UTC'
 
+CELERY_BEAT_SCHEDULE = {
+    'purge-expired-tokens': {
+        'task': 'accounts.tasks.purge_expired_tokens',
+        'schedule': crontab(minute='*/15'),
+    },
+    'purge-tombstones': {
+        'task': 'accounts.tasks.purge_tombstones',
+        'schedule': crontab(minute=30, hour=3),
+    },
+    'drain-outbox': {
+        'task': 'accounts.tasks.drain_outbox',
+        'schedule': MAIL_FLUSH_INTERVAL_MS / 1000,
+    },
+}
+
 # CELERY_RESULT_BACKEND = os.getenv('REDIS_RESULTS')
 
 
@@ -19,17 +19,18 @@ from django.contrib import admin
 from django.conf.urls.static import static
 from django.urls import path, include
 from accounts.urls import router
-from rest_framework_jwt.views import verify_jwt_token, obtain_jwt_token
+from rest_framework_jwt.views import ObtainJSONWebToken, verify_jwt_token
 
 from accounts.views import ConfirmUserViewSet, PasswordChangeRequestViewSet, PasswordChangeViewSet, \
     ResetConfirmUserToken
+from accounts.throttling import PublicEndpointThrottle
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     url(r'^v1/verify/', verify_jwt_token),
-    url(r'^v1/auth/', obtain_jwt_token),
+    url(r'^v1/auth/', ObtainJSONWebToken.as_view(throttle_classes=(PublicEndpointThrottle,))),
     url(r'^v1/request_password_change/', PasswordChangeRequestViewSet.as_view({'post': 'create'})),
-    url(r'^v1/change_password/(?P<id>[/\w-]+)/$', PasswordChangeViewSet.as_view({'post': 'change'})),
+    url(r'^v1/change_password/(?P<id>[/\w:.-]+)/$', PasswordChangeViewSet.as_view({'post': 'change'})),
     url(r'^v1/confirm/', ConfirmUserViewSet.as_view({'post': 'confirm'})),
     url(r'^v1/reset_confirm/', ResetConfirmUserToken.as_view({'post': 'confirm'})),
     url(r'^v1/', include((router.urls, 'accounts'), namespace='accounts')),